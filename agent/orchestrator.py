@@ -2,14 +2,24 @@ import json
 import os
 import re
 import subprocess
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, TextIO, Tuple
 import shlex
 import hashlib
 import glob
 import time
-
-from agent.stacks.registry import resolve_stack_spec, load_catalog
-from jsonschema import validate
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from importlib.resources import files
+from importlib.util import find_spec
+
+from agent.stacks.registry import clear_detection_cache, resolve_stack_spec, load_catalog
+from agent.stacks.catalog_utils import (
+    bootstrap_kind_for_stack,
+    scan_markers,
+)
+from jsonschema.validators import validator_for
+from jsonschema.exceptions import best_match
 
 from agent.tools.github_tools import (
     get_issue,
@@ -17,11 +27,14 @@ from agent.tools.github_tools import (
     git_commit_all,
     git_push,
     git_commits_ahead,
+    git_changes,
+    git_status_entries,
     gh_pr_ensure,
 )
+from agent.tools.extract_request import extract_json_from_comment
 from agent.tools.llm import chat_json
 from agent.tools.patch_apply import apply_patch_object
-from agent.tools.repo_introspect import list_files, snapshot
+from agent.tools.repo_introspect import iter_files, snapshot
 
 # Use ONLY failure_hints module (no local override)
 from agent.tools.failure_hints import (
@@ -36,35 +49,101 @@ except Exception:
     pine_query = None
     pine_upsert = None
 
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+try:
+    import fastjsonschema
+except Exception:
+    fastjsonschema = None
+
 BASE_DIR = os.path.dirname(__file__)
 
 
+def _dumps(obj: Any, indent: bool = False) -> str:
+    """json.dumps(..., ensure_ascii=False[, indent=2]) via orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None)
+
+
+def _loads(raw: str | bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+@lru_cache(maxsize=32)
+def _read_bytes_cached(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
 def load_json(path: str) -> Dict[str, Any]:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    """The file is read once per path (immutable bytes); each call parses a fresh dict the caller may mutate."""
+    return _loads(_read_bytes_cached(path))
+
+
+def _load_schema(name: str) -> Dict[str, Any]:
+    """Schemas ship inside the agent package: read bytes straight into the (orjson) parser."""
+    if __package__:
+        return _loads(files(__package__).joinpath("schemas", name).read_bytes())
+    return load_json(os.path.join(BASE_DIR, "schemas", name))
+
+
+RUN_SCHEMA = _load_schema("run_request.schema.json")
+PLAN_SCHEMA = _load_schema("plan.schema.json")
+PATCH_SCHEMA = _load_schema("patch.schema.json")
+TEST_SCHEMA = _load_schema("test_report.schema.json")
+
 
+# Validators built lazily once per schema, keyed by id() of the module-level schema dicts,
+# instead of on every validate() call. fastjsonschema (optional) compiles each schema into
+# a generated Python function; jsonschema validators are the fallback.
+_VALIDATORS: Dict[int, Any] = {}
+_FAST_VALIDATORS: Dict[int, Any] = {}
 
-RUN_SCHEMA = load_json(os.path.join(BASE_DIR, "schemas", "run_request.schema.json"))
-PLAN_SCHEMA = load_json(os.path.join(BASE_DIR, "schemas", "plan.schema.json"))
-PATCH_SCHEMA = load_json(os.path.join(BASE_DIR, "schemas", "patch.schema.json"))
-TEST_SCHEMA = load_json(os.path.join(BASE_DIR, "schemas", "test_report.schema.json"))
+
+def _validator(schema: Dict[str, Any]) -> Any:
+    v = _VALIDATORS.get(id(schema))
+    if v is None:
+        cls = validator_for(schema)
+        cls.check_schema(schema)
+        v = _VALIDATORS[id(schema)] = cls(schema)
+    return v
+
+
+def _fast_validator(schema: Dict[str, Any]) -> Any:
+    if fastjsonschema is None:
+        return None
+    key = id(schema)
+    if key not in _FAST_VALIDATORS:
+        try:
+            # use_default=False: validate only, never inject schema defaults into the object
+            _FAST_VALIDATORS[key] = fastjsonschema.compile(schema, use_default=False)
+        except Exception:
+            _FAST_VALIDATORS[key] = None
+    return _FAST_VALIDATORS[key]
 
 
 def safe_validate(obj: Dict[str, Any], schema: Dict[str, Any], schema_name: str) -> None:
+    fast = _fast_validator(schema)
+    if fast is not None:
+        try:
+            fast(obj)
+            return
+        except fastjsonschema.JsonSchemaException as e:
+            raise ValueError(f"JSON inválido para {schema_name}: {e.message}") from e
+
     try:
-        validate(instance=obj, schema=schema)
+        err = best_match(_validator(schema).iter_errors(obj))
     except Exception as e:
         msg = getattr(e, "message", str(e))
         raise ValueError(f"JSON inválido para {schema_name}: {msg}") from e
-
-
-def extract_json_from_comment(body: str) -> Dict[str, Any]:
-    m = re.search(r"/agent\s+run\s*(\{.*\})\s*$", (body or "").strip(), re.DOTALL)
-    if not m:
-        m = re.search(r"(\{.*\})", (body or "").strip(), re.DOTALL)
-    if not m:
-        raise ValueError("No se encontró JSON. Usa: /agent run { ... }")
-    return json.loads(m.group(1))
+    if err is not None:
+        raise ValueError(f"JSON inválido para {schema_name}: {err.message}") from err
 
 
 def _stringify_value(v: Any) -> str:
@@ -102,7 +181,7 @@ def _coerce_test_strategy(v: Any) -> str:
 
 def _mk_task_id(i: int, title: str, desc: str) -> str:
     base = f"{i}:{title}:{desc}"
-    h = hashlib.sha1(base.encode("utf-8", errors="ignore")).hexdigest()[:8]
+    h = hashlib.blake2b(base.encode("utf-8", errors="ignore"), digest_size=4).hexdigest()
     return f"T{i:02d}-{h}"
 
 
@@ -320,20 +399,31 @@ def _read_text(path: str) -> str:
         return f.read()
 
 
+_TEST_FILE_SUFFIXES = ("_test.go", ".spec.ts", ".spec.js", ".test.ts", ".test.js")
+
+
 def _is_test_path(p: str) -> bool:
     p = p.replace("\\", "/").lower()
     return (
-        "/test/" in p
-        or p.endswith("_test.go")
-        or p.endswith(".spec.ts")
-        or p.endswith(".spec.js")
-        or p.endswith(".test.ts")
-        or p.endswith(".test.js")
-        or "/__tests__/" in p
+        p.endswith(_TEST_FILE_SUFFIXES)
+        or "/test/" in p
         or "/tests/" in p
+        or "/__tests__/" in p
     )
 
 
+PREV_TEST_OUTPUT_MAX_BYTES = 60_000
+
+
+def _read_tail(path: str, max_bytes: int) -> str:
+    """Last max_bytes of a text file (failures and test summaries live at the end of logs)."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - max_bytes))
+        return f.read().decode("utf-8", errors="replace")
+
+
 def _read_file_safe(path: str) -> str:
     try:
         with open(path, "r", encoding="utf-8", errors="replace") as f:
@@ -342,6 +432,64 @@ def _read_file_safe(path: str) -> str:
         return ""
 
 
+# Policy regexes (financial expected hardcoded), compiled once at import
+# Marcadores humanos (ES/EN)
+_FIN_MARKER_WORDS = [
+    r"c[aá]lculo\s+manual",
+    r"derivad[oa]",
+    r"valores?\s+conocid[oa]s",
+    r"known\s+value",
+    r"hand\s*calc",
+    r"manual\s+calc",
+    r"calculated\s+manually",
+]
+_FIN_MARKER = r"(?:%s)" % "|".join(_FIN_MARKER_WORDS)
+
+# variables expected típicas
+_FIN_EXPECTED_VARS = [
+    r"cuota_esperada",
+    r"pago_esperado",
+    r"monthly_payment_expected",
+    r"expected_monthly_payment",
+    r"expectedPayment",
+    r"expected",
+]
+
+# número literal
+_FIN_NUM = r"\d+(?:\.\d+)?"
+
+# comentario con marker
+_FIN_COMMENT = r"(?:#|//|/\*)\s*(?:" + _FIN_MARKER + r")"
+
+# (a) asignación expected = 123.45 ... comment(marker)
+_FIN_PAT_ASSIGN = re.compile(
+    r"(?is)\b(" + "|".join(_FIN_EXPECTED_VARS) + r")\b\s*(?:=|:)\s*" + _FIN_NUM + r".{0,120}?" + _FIN_COMMENT
+)
+
+# (b1) JUnit/Java: assertEquals(123.45, something, tol) // marker
+_FIN_PAT_JUNIT = re.compile(
+    r"(?is)\bassert(?:Equals|That)\s*\(\s*" + _FIN_NUM + r"\s*,.{0,200}?\)\s*(?:" + _FIN_COMMENT + r")"
+)
+
+# (b2) Python/pytest: pytest.approx(123.45) # marker
+_FIN_PAT_PYTEST = re.compile(
+    r"(?is)\bpytest\.approx\s*\(\s*" + _FIN_NUM + r"(?:\s*,[^)]*)?\)\s*(?:" + _FIN_COMMENT + r")"
+)
+
+# (b3) JS: toBeCloseTo(123.45) // marker  OR closeTo(123.45)
+_FIN_PAT_JS = re.compile(
+    r"(?is)\b(?:toBeCloseTo|closeTo)\s*\(\s*" + _FIN_NUM + r"(?:\s*,[^)]*)?\)\s*(?:" + _FIN_COMMENT + r")"
+)
+
+# (b4) Genérico: cualquier literal numérico seguido de comment(marker) en la misma línea
+_FIN_PAT_LINE_LITERAL = re.compile(
+    r"(?im)^(?P<line>.{0,400}?\b" + _FIN_NUM + r"\b.{0,120}?" + _FIN_COMMENT + r".*)$"
+)
+
+# Every policy pattern requires a marker comment: files without one are skipped outright
+_FIN_MARKER_RE = re.compile(_FIN_MARKER, re.IGNORECASE)
+
+
 def detect_financial_expected_antipattern(changed_files: List[str]) -> Dict[str, Any]:
     """
     Policy (enterprise): en tests financieros NO se permite hardcodear expected "manual/derivado"
@@ -353,59 +501,6 @@ def detect_financial_expected_antipattern(changed_files: List[str]) -> Dict[str,
       (a) asignación expected = 123.45 con comentario "manual/derivado/known"
       (b) asserts con literal numérico + comentario "manual/derivado/known"
     """
-    # Marcadores humanos (ES/EN)
-    marker_words = [
-        r"c[aá]lculo\s+manual",
-        r"derivad[oa]",
-        r"valores?\s+conocid[oa]s",
-        r"known\s+value",
-        r"hand\s*calc",
-        r"manual\s+calc",
-        r"calculated\s+manually",
-    ]
-    marker = r"(?:%s)" % "|".join(marker_words)
-
-    # variables expected típicas
-    expected_vars = [
-        r"cuota_esperada",
-        r"pago_esperado",
-        r"monthly_payment_expected",
-        r"expected_monthly_payment",
-        r"expectedPayment",
-        r"expected",
-    ]
-
-    # número literal
-    num = r"\d+(?:\.\d+)?"
-
-    # comentario con marker
-    comment = r"(?:#|//|/\*)\s*(?:" + marker + r")"
-
-    # (a) asignación expected = 123.45 ... comment(marker)
-    pat_assign = re.compile(
-        r"(?is)\b(" + "|".join(expected_vars) + r")\b\s*(?:=|:)\s*" + num + r".{0,120}?" + comment
-    )
-
-    # (b1) JUnit/Java: assertEquals(123.45, something, tol) // marker
-    pat_junit = re.compile(
-        r"(?is)\bassert(?:Equals|That)\s*\(\s*" + num + r"\s*,.{0,200}?\)\s*(?:" + comment + r")"
-    )
-
-    # (b2) Python/pytest: pytest.approx(123.45) # marker
-    pat_pytest = re.compile(
-        r"(?is)\bpytest\.approx\s*\(\s*" + num + r"(?:\s*,[^)]*)?\)\s*(?:" + comment + r")"
-    )
-
-    # (b3) JS: toBeCloseTo(123.45) // marker  OR closeTo(123.45)
-    pat_js = re.compile(
-        r"(?is)\b(?:toBeCloseTo|closeTo)\s*\(\s*" + num + r"(?:\s*,[^)]*)?\)\s*(?:" + comment + r")"
-    )
-
-    # (b4) Genérico: cualquier literal numérico seguido de comment(marker) en la misma línea
-    pat_line_literal = re.compile(
-        r"(?im)^(?P<line>.{0,400}?\b" + num + r"\b.{0,120}?" + comment + r".*)$"
-    )
-
     suspects: List[Dict[str, Any]] = []
     for p in changed_files or []:
         p2 = p.replace("\\", "/")
@@ -415,16 +510,18 @@ def detect_financial_expected_antipattern(changed_files: List[str]) -> Dict[str,
             continue
 
         txt = _read_file_safe(p2)
+        if not _FIN_MARKER_RE.search(txt):
+            continue
         m = (
-            pat_assign.search(txt)
-            or pat_junit.search(txt)
-            or pat_pytest.search(txt)
-            or pat_js.search(txt)
+            _FIN_PAT_ASSIGN.search(txt)
+            or _FIN_PAT_JUNIT.search(txt)
+            or _FIN_PAT_PYTEST.search(txt)
+            or _FIN_PAT_JS.search(txt)
         )
 
         # fallback: línea con literal + marker
         if not m:
-            m2 = pat_line_literal.search(txt)
+            m2 = _FIN_PAT_LINE_LITERAL.search(txt)
             if m2:
                 suspects.append({
                     "path": p2,
@@ -448,72 +545,14 @@ def _glob_many(patterns: List[str]) -> List[str]:
     out: List[str] = []
     for pat in patterns:
         out.extend(glob.glob(pat, recursive=True))
-    # unique, stable
+    # unique, insertion-ordered: the snapshot sorts symbols/endpoints itself
     seen = set()
     uniq = []
     for p in out:
         if os.path.isfile(p) and p not in seen:
             seen.add(p)
             uniq.append(p)
-    return sorted(uniq)
-
-
-def _exists_any_glob(patterns: List[str]) -> bool:
-    for pat in patterns or []:
-        try:
-            if _glob_many([pat]):
-                return True
-        except Exception:
-            continue
-    return False
-
-def _catalog_stacks_view(catalog: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    Soporta ambos formatos:
-      A) mapping plano (tu caso): { "python-django": {...}, "java-spring-boot": {...} }
-      B) wrapper: { "stacks": { ... } }
-    """
-    if not isinstance(catalog, dict):
-        return {}
-    stacks = catalog.get("stacks")
-    if isinstance(stacks, dict):
-        return stacks
-    return catalog
-
-
-def _catalog_entry(catalog: Dict[str, Any], stack_id: str) -> Dict[str, Any]:
-    stacks = _catalog_stacks_view(catalog)
-    entry = stacks.get(stack_id) if isinstance(stacks, dict) else None
-    return entry if isinstance(entry, dict) else {}
-
-
-def _markers_found_for_stack(catalog: Dict[str, Any], stack_id: str) -> bool:
-    entry = _catalog_entry(catalog, stack_id)
-    markers = entry.get("markers") if isinstance(entry.get("markers"), dict) else {}
-    any_of = markers.get("any_of") or []
-    if not isinstance(any_of, list) or not any_of:
-        return False
-    return _exists_any_glob(any_of)
-
-
-def _repo_has_any_stack_markers(catalog: Dict[str, Any]) -> bool:
-    stacks = _catalog_stacks_view(catalog)
-    if not isinstance(stacks, dict):
-        return False
-    for _sid, entry in stacks.items():
-        if not isinstance(entry, dict):
-            continue
-        markers = entry.get("markers") if isinstance(entry.get("markers"), dict) else {}
-        any_of = markers.get("any_of") or []
-        if isinstance(any_of, list) and any_of and _exists_any_glob(any_of):
-            return True
-    return False
-
-
-def _bootstrap_kind_for_stack(catalog: Dict[str, Any], stack_id: str) -> str:
-    entry = _catalog_entry(catalog, stack_id)
-    bootstrap = entry.get("bootstrap") if isinstance(entry.get("bootstrap"), dict) else {}
-    return str(bootstrap.get("kind") or "none").strip().lower()
+    return uniq
 
 
 def _snapshot_hash(payload: Dict[str, Any]) -> str:
@@ -523,46 +562,49 @@ def _snapshot_hash(payload: Dict[str, Any]) -> str:
 
 # -------- Extractors (heurísticos, multi-stack) --------
 
-def _extract_java_public_symbols() -> List[Dict[str, Any]]:
-    files = _glob_many(["src/main/java/**/*.java"])
-    syms: List[Dict[str, Any]] = []
+def _java_main_sources() -> List[Tuple[str, str]]:
+    """(path, text) of non-test sources under src/main/java, globbed and read once."""
+    return [(fp, _read_text(fp)) for fp in _glob_many(["src/main/java/**/*.java"]) if not _is_test_path(fp)]
 
-    pkg_re = re.compile(r"(?m)^\s*package\s+([a-zA-Z0-9_.]+)\s*;")
-    class_re = re.compile(r"(?m)^\s*public\s+(?:final\s+|abstract\s+)?class\s+([A-Za-z_]\w*)")
-    iface_re = re.compile(r"(?m)^\s*public\s+interface\s+([A-Za-z_]\w*)")
-    enum_re  = re.compile(r"(?m)^\s*public\s+enum\s+([A-Za-z_]\w*)")
 
-    # Captura también nombres de params (clave para years↔months)
-    method_re = re.compile(
-        r"(?m)^\s*public\s+(?:static\s+)?(?:final\s+)?([A-Za-z_]\w*(?:<[^>]+>)?)\s+([A-Za-z_]\w*)\s*\(([^)]*)\)\s*\{?"
-    )
+_JAVA_PKG_RE = re.compile(r"(?m)^\s*package\s+([a-zA-Z0-9_.]+)\s*;")
+_JAVA_CLASS_RE = re.compile(r"(?m)^\s*public\s+(?:final\s+|abstract\s+)?class\s+([A-Za-z_]\w*)")
+_JAVA_IFACE_RE = re.compile(r"(?m)^\s*public\s+interface\s+([A-Za-z_]\w*)")
+_JAVA_ENUM_RE = re.compile(r"(?m)^\s*public\s+enum\s+([A-Za-z_]\w*)")
+# Captura también nombres de params (clave para years↔months)
+_JAVA_METHOD_RE = re.compile(
+    r"(?m)^\s*public\s+(?:static\s+)?(?:final\s+)?([A-Za-z_]\w*(?:<[^>]+>)?)\s+([A-Za-z_]\w*)\s*\(([^)]*)\)\s*\{?"
+)
+_WS_RE = re.compile(r"\s+")
 
-    for fp in files:
-        if _is_test_path(fp):
-            continue
-        txt = _read_text(fp)
 
+def _extract_java_public_symbols(sources: List[Tuple[str, str]] | None = None) -> List[Dict[str, Any]]:
+    if sources is None:
+        sources = _java_main_sources()
+    syms: List[Dict[str, Any]] = []
+
+    for fp, txt in sources:
         pkg = ""
-        m = pkg_re.search(txt)
+        m = _JAVA_PKG_RE.search(txt)
         if m:
             pkg = m.group(1).strip()
 
         def qname(x: str) -> str:
             return f"{pkg}.{x}" if pkg else x
 
-        for m in class_re.finditer(txt):
+        for m in _JAVA_CLASS_RE.finditer(txt):
             syms.append({"kind": "java.class", "name": qname(m.group(1)), "path": fp})
 
-        for m in iface_re.finditer(txt):
+        for m in _JAVA_IFACE_RE.finditer(txt):
             syms.append({"kind": "java.interface", "name": qname(m.group(1)), "path": fp})
 
-        for m in enum_re.finditer(txt):
+        for m in _JAVA_ENUM_RE.finditer(txt):
             syms.append({"kind": "java.enum", "name": qname(m.group(1)), "path": fp})
 
-        for m in method_re.finditer(txt):
+        for m in _JAVA_METHOD_RE.finditer(txt):
             ret = m.group(1).strip()
             name = m.group(2).strip()
-            args = re.sub(r"\s+", " ", m.group(3).strip())
+            args = _WS_RE.sub(" ", m.group(3).strip())
             syms.append({
                 "kind": "java.method",
                 "name": qname(name),
@@ -573,29 +615,30 @@ def _extract_java_public_symbols() -> List[Dict[str, Any]]:
     return syms
 
 
-def _extract_spring_endpoints() -> List[Dict[str, Any]]:
-    files = _glob_many(["src/main/java/**/*.java"])
-    eps: List[Dict[str, Any]] = []
+_SPRING_REQMAP_RE = re.compile(r'@RequestMapping\(\s*"(.*?)"\s*\)')
+_SPRING_METHOD_MAPS = [
+    (re.compile(r'@GetMapping\(\s*"(.*?)"\s*\)'), "GET"),
+    (re.compile(r'@PostMapping\(\s*"(.*?)"\s*\)'), "POST"),
+    (re.compile(r'@PutMapping\(\s*"(.*?)"\s*\)'), "PUT"),
+    (re.compile(r'@DeleteMapping\(\s*"(.*?)"\s*\)'), "DELETE"),
+]
 
-    reqmap = re.compile(r'@RequestMapping\(\s*"(.*?)"\s*\)')
-    getmap = re.compile(r'@GetMapping\(\s*"(.*?)"\s*\)')
-    postmap = re.compile(r'@PostMapping\(\s*"(.*?)"\s*\)')
-    putmap = re.compile(r'@PutMapping\(\s*"(.*?)"\s*\)')
-    delmap = re.compile(r'@DeleteMapping\(\s*"(.*?)"\s*\)')
 
-    for fp in files:
-        if _is_test_path(fp):
-            continue
-        txt = _read_text(fp)
+def _extract_spring_endpoints(sources: List[Tuple[str, str]] | None = None) -> List[Dict[str, Any]]:
+    if sources is None:
+        sources = _java_main_sources()
+    eps: List[Dict[str, Any]] = []
+
+    for fp, txt in sources:
         if "@RestController" not in txt and "@Controller" not in txt:
             continue
 
         base = ""
-        m = reqmap.search(txt)
+        m = _SPRING_REQMAP_RE.search(txt)
         if m:
             base = m.group(1).strip()
 
-        for ann, method in [(getmap, "GET"), (postmap, "POST"), (putmap, "PUT"), (delmap, "DELETE")]:
+        for ann, method in _SPRING_METHOD_MAPS:
             for mm in ann.finditer(txt):
                 route = mm.group(1).strip()
                 full = (base.rstrip("/") + "/" + route.lstrip("/")).replace("//", "/") if base else route
@@ -615,10 +658,12 @@ def generate_contract_snapshot(run_req: Dict[str, Any]) -> Dict[str, Any]:
     symbols: List[Dict[str, Any]] = []
     endpoints: List[Dict[str, Any]] = []
 
-    # Java/Spring
-    if lang == "java" or stack.startswith("java-") or os.path.exists("pom.xml") or _glob_many(["src/main/java/**/*.java"]):
-        symbols.extend(_extract_java_public_symbols())
-        endpoints.extend(_extract_spring_endpoints())
+    # Java/Spring: glob + read src/main/java once and share it between both extractors
+    java_files = _glob_many(["src/main/java/**/*.java"])
+    if lang == "java" or stack.startswith("java-") or os.path.exists("pom.xml") or java_files:
+        sources = [(fp, _read_text(fp)) for fp in java_files if not _is_test_path(fp)]
+        symbols.extend(_extract_java_public_symbols(sources))
+        endpoints.extend(_extract_spring_endpoints(sources))
 
     # Normalización: orden estable
     def _key(x: Dict[str, Any]) -> str:
@@ -728,6 +773,19 @@ def _has_shell_metachars(cmd: str) -> bool:
     return bool(re.search(r"[;&|`$><\n\r]", cmd or ""))
 
 
+_XDIST_FLAGS_RE = re.compile(r"\s(?:-n\s*=?\s*|--numprocesses[=\s]\s*|--dist[=\s]\s*|--maxprocesses[=\s]\s*)\S+")
+
+
+def drop_xdist_flags_if_missing(cmd: str) -> str:
+    """
+    El default de pytest usa "-n auto --dist=loadfile"; sin pytest-xdist instalado pytest falla con
+    "unrecognized arguments". En ese caso se quitan esos flags y los tests corren en serie.
+    """
+    if "pytest" not in (cmd or "") or find_spec("xdist") is not None:
+        return cmd
+    return _XDIST_FLAGS_RE.sub("", f" {cmd}").strip()
+
+
 def is_safe_test_command(cmd: str, allowed_prefixes: List[str]) -> bool:
     """
     Enterprise safety:
@@ -821,26 +879,56 @@ def run_cmd(cmd: str) -> Tuple[int, str]:
     return p.returncode, out
 
 
-def detect_repo_changes() -> List[str]:
-    changed: set[str] = set()
+_KEY_SUFFIXES = (
+    "pyproject.toml", "requirements.txt", "package.json", "package-lock.json",
+    "pom.xml", "build.gradle", "gradlew", "go.mod",
+    ".sln", ".csproj",
+    "README.md", "Makefile", "pytest.ini", "tox.ini",
+)
+KEY_CANDIDATES_LIMIT = 60
+
+def collect_repo_snapshot() -> Tuple[List[str], Dict[str, str]]:
+    """Pick the key files (manifests, README, test config) and snapshot their content."""
+    # iter_files() streams unique, pruned paths: one pass, stop at the snapshot limit
+    key_candidates: List[str] = []
+    for p in iter_files("."):
+        if p.endswith(_KEY_SUFFIXES):
+            key_candidates.append(p)
+            if len(key_candidates) == KEY_CANDIDATES_LIMIT:
+                break
+    return key_candidates, snapshot(key_candidates)
+
+
+TEST_OUTPUT_HEAD_LINES = 2000
+TEST_OUTPUT_TAIL_LINES = 4096
 
-    code, out = run_cmd("git diff --name-only")
-    if code == 0:
-        for line in (out or "").splitlines():
-            line = line.strip()
-            if line:
-                changed.add(line)
 
-    code, st = run_cmd("git status --porcelain")
-    if code == 0:
-        for line in (st or "").splitlines():
-            if not line.strip():
+def run_cmd_streamed(cmd: str) -> Tuple[int, str]:
+    """
+    Like run_cmd, but streams stdout+stderr line by line and keeps only the head and the tail
+    of very long outputs, so chatty test suites don't hold multi-MB logs in memory.
+    """
+    args = shlex.split(cmd)
+    head: List[str] = []
+    tail: deque = deque(maxlen=TEST_OUTPUT_TAIL_LINES)
+    dropped = 0
+    with subprocess.Popen(args, text=True, errors="replace", stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as proc:
+        for line in proc.stdout:
+            if len(head) < TEST_OUTPUT_HEAD_LINES:
+                head.append(line)
                 continue
-            path = line[3:].strip() if len(line) >= 4 else ""
-            if path:
-                if " -> " in path:
-                    path = path.split(" -> ", 1)[1].strip()
-                changed.add(path)
+            if len(tail) == tail.maxlen:
+                dropped += 1
+            tail.append(line)
+        code = proc.wait()
+    if dropped:
+        head.append(f"\n[... {dropped} líneas omitidas ...]\n\n")
+    return code, "".join(head) + "".join(tail)
+
+
+def detect_repo_changes(status_entries: List[str] | None = None) -> List[str]:
+    # `git status --porcelain` already covers everything `git diff --name-only` reports
+    changed = set(git_changes(status_entries))
 
     filtered = [p for p in sorted(changed) if not _is_transient_path(p)]
     return filtered
@@ -860,57 +948,92 @@ def compact_memories(matches: List[Dict[str, Any]]) -> str:
     return "\n---\n".join(texts)
 
 
-def pine_upsert_event(repo: str, issue_number: str, kind: str, text: str, extra: Dict[str, Any] | None = None) -> None:
-    if not pine_upsert:
+def memory_event(issue_number: str, kind: str, text: str, extra: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """
+    Build one memory item for pine_upsert_events.
+    The id identifies the event (kind/issue/run/iteration) and is stored as metadata
+    "event_id"; the vector id is the text's content hash, so repeated texts are stored once.
+    """
+    extra = extra or {}
+    event_id = f"{kind}:{issue_number}:{os.environ.get('GITHUB_RUN_ID','')}-{os.environ.get('GITHUB_RUN_ATTEMPT','')}"
+    if "iteration" in extra:
+        event_id = f"{event_id}:{extra['iteration']}"
+    return {
+        "id": event_id,
+        "text": text,
+        "metadata": {"kind": kind, **extra},
+    }
+
+
+def pine_upsert_events(repo: str, issue_number: str, items: List[Dict[str, Any]]) -> None:
+    """Flush buffered memory events in one Pinecone upsert (one embedding call, one write)."""
+    if not pine_upsert or not items:
         return
     try:
-        payload = {
-            "id": f"{kind}:{issue_number}:{os.environ.get('GITHUB_RUN_ID','')}-{os.environ.get('GITHUB_RUN_ATTEMPT','')}",
-            "text": text,
-            "metadata": {"kind": kind, **(extra or {})},
-        }
-        pine_upsert(repo, issue_number, [payload])
+        pine_upsert(repo, issue_number, items)
     except Exception:
         return
 
 
+def _open_out(path: str, buffering: int = -1) -> TextIO:
+    # Open first, create the parent only when it is missing: no makedirs per artifact, and still
+    # correct after `git clean -fd` removed agent/out during a revert.
+    try:
+        return open(path, "w", encoding="utf-8", errors="replace", buffering=buffering)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return open(path, "w", encoding="utf-8", errors="replace", buffering=buffering)
+
+
 def write_out(path: str, content: str) -> None:
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8", errors="replace") as f:
+    with _open_out(path) as f:
         f.write(content if content.endswith("\n") else content + "\n")
 
 
-def render_summary_md(issue_title: str, pr_url: str, iteration_notes: List[str], test_report: Dict[str, Any]) -> str:
-    md = []
-    md.append("## 🤖 Agent 결과\n\n")
-    md.append(f"**Issue:** {issue_title}\n\n")
+def finalize_test_report(tr: Dict[str, Any], run_req: Dict[str, Any]) -> Dict[str, Any]:
+    test_report = normalize_test_report(tr, run_req)
+    safe_validate(test_report, TEST_SCHEMA, "test_report.schema.json")
+    return test_report
+
+
+def write_summary_md(
+    md: TextIO, issue_title: str, pr_url: str, iteration_notes: List[str], test_report: Dict[str, Any]
+) -> None:
+    md.write(f"## 🤖 Agent 결과\n\n**Issue:** {issue_title}\n\n")
     if pr_url:
-        md.append(f"**PR:** {pr_url}\n\n")
-    md.append("\n---\n")
-    md.append("### Iteraciones\n")
-    for n in iteration_notes:
-        md.append(f"- {n}\n")
-    md.append("\n---\n")
-    md.append("### Test report\n")
-    md.append(f"- Passed: `{test_report.get('passed')}`\n")
-    md.append(f"- Summary: {test_report.get('summary','')}\n")
+        md.write(f"**PR:** {pr_url}\n\n")
+    md.write("\n---\n### Iteraciones\n")
+    md.writelines(f"- {n}\n" for n in iteration_notes)
+    md.write(
+        "\n---\n### Test report\n"
+        f"- Passed: `{test_report.get('passed')}`\n"
+        f"- Summary: {test_report.get('summary','')}\n"
+    )
     if test_report.get("failure_hints"):
-        md.append("\n### Failure hints\n")
-        for h in test_report["failure_hints"][:12]:
-            md.append(f"- {h}\n")
-    return "".join(md)
+        md.write("\n### Failure hints\n")
+        md.writelines(f"- {h}\n" for h in test_report["failure_hints"][:12])
+
+
+_FAILURE_LINE_RE = re.compile(r"(ERROR:.*|AssertionError:.*|Traceback.*|FAIL:.*)", re.IGNORECASE)
 
 
 def stable_failure_signature(test_exit: int, test_out: str) -> str:
-    top = test_out.strip().splitlines()[:80]
+    # Only the first 80 lines matter: split a bounded head instead of the whole output
+    top = test_out[:16000].strip().splitlines()[:80]
     top = "\n".join(top)
-    m2 = re.search(r"(ERROR:.*|AssertionError:.*|Traceback.*|FAIL:.*)", top, re.IGNORECASE)
+    m2 = _FAILURE_LINE_RE.search(top)
     top = m2.group(1).strip() if m2 else ""
     return f"exit={test_exit}|{top[:200]}"
 
 
+@lru_cache(maxsize=None)
 def _load_prompt(rel_path: str) -> str:
-    return open(os.path.join(BASE_DIR, "prompts", rel_path), "r", encoding="utf-8").read()
+    with open(os.path.join(BASE_DIR, "prompts", rel_path), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+# blake2b(invalid plan + validation error) -> normalized repaired plan (per process)
+_PLAN_REPAIR_CACHE: Dict[str, Dict[str, Any]] = {}
 
 
 def _attempt_plan_repair_once(
@@ -925,12 +1048,20 @@ def _attempt_plan_repair_once(
 ) -> Dict[str, Any]:
     repair_prompt = _load_prompt("repair_plan_agent.md")
 
-    write_out("agent/out/plan_invalid.json", json.dumps(invalid_plan, ensure_ascii=False, indent=2))
+    write_out("agent/out/plan_invalid.json", _dumps(invalid_plan, indent=True))
     write_out("agent/out/plan_validation_error.txt", validation_error)
 
+    # Same invalid plan + same error -> reuse the previous repair instead of another LLM round trip
+    canonical = json.dumps([invalid_plan, validation_error], ensure_ascii=False, sort_keys=True, default=str)
+    key = hashlib.blake2b(canonical.encode("utf-8", errors="ignore"), digest_size=16).hexdigest()
+    cached = _PLAN_REPAIR_CACHE.get(key)
+    if cached is not None:
+        write_out("agent/out/plan_repaired.json", _dumps(cached, indent=True))
+        return cached
+
     repaired = chat_json(
         system=repair_prompt,
-        user=json.dumps({
+        user=_dumps({
             "schema_json": PLAN_SCHEMA,
             "invalid_plan_json": invalid_plan,
             "validation_error": validation_error,
@@ -945,12 +1076,14 @@ def _attempt_plan_repair_once(
                 "repo_snapshot": repo_snap,
                 "memories": memories,
             }
-        }, ensure_ascii=False),
+        }),
         schema_name="plan.schema.json",
+        schema=PLAN_SCHEMA,
     )
 
     repaired = normalize_plan(repaired)
-    write_out("agent/out/plan_repaired.json", json.dumps(repaired, ensure_ascii=False, indent=2))
+    _PLAN_REPAIR_CACHE[key] = repaired
+    write_out("agent/out/plan_repaired.json", _dumps(repaired, indent=True))
     return repaired
 
 def parse_pytest_telemetry(out: str) -> Dict[str, int]:
@@ -1057,7 +1190,12 @@ def main() -> None:
     write_out("agent/out/branch.txt", "")
     write_out("agent/out/pr_url.txt", "")
 
-    issue = get_issue(repo, issue_number)
+    # Independent I/O (GitHub API, repo walk + snapshot, Pinecone) overlaps on a small pool
+    pool = ThreadPoolExecutor(max_workers=3)
+    fut_issue = pool.submit(get_issue, repo, issue_number)
+    fut_snap = pool.submit(collect_repo_snapshot)
+
+    issue = fut_issue.result()
     issue_title = issue.get("title", "")
     issue_body = issue.get("body", "") or ""
 
@@ -1071,14 +1209,17 @@ def main() -> None:
 
     spec = resolve_stack_spec(run_req, repo_root=".", catalog=catalog)
 
-    if explicit_stack and not _markers_found_for_stack(catalog, spec.stack_id):
+    # One pass over every stack's markers; the guard below only does lookups.
+    stack_markers = scan_markers(catalog) if explicit_stack else {}
+
+    if explicit_stack and not stack_markers.get(spec.stack_id, False):
         # If repo looks like SOME other stack, do NOT try to run tests with a mismatched stack.
-        if _repo_has_any_stack_markers(catalog):
+        if any(stack_markers.values()):
             fallback_req = dict(run_req)
             fallback_req["stack"] = "auto"
             spec2 = resolve_stack_spec(fallback_req, repo_root=".", catalog=catalog)
 
-            if _markers_found_for_stack(catalog, spec2.stack_id):
+            if stack_markers.get(spec2.stack_id, False):
                 write_out(
                     "agent/out/stack_resolution.txt",
                     (
@@ -1097,7 +1238,7 @@ def main() -> None:
         else:
             # Repo sin markers detectables (greenfield o repo-orquestador).
             # NO fallar si el stack solicitado define bootstrap: stack_setup hará scaffold.
-            bk = _bootstrap_kind_for_stack(catalog, requested_stack)
+            bk = bootstrap_kind_for_stack(catalog, requested_stack)
 
             write_out(
                 "agent/out/stack_resolution.txt",
@@ -1129,25 +1270,23 @@ def main() -> None:
             "test_command rechazado por seguridad. "
             "Usa un comando estándar del stack (sin ; & | $ ` > < ni saltos de línea)."
         )
+    if run_req.get("test_command"):
+        run_req["test_command"] = drop_xdist_flags_if_missing(str(run_req["test_command"]))
 
     memories = ""
+    fut_mem = None
     if pine_query:
+        mem_query_text = f"{run_req.get('stack')} | {run_req.get('language')} | {run_req.get('user_story')} | {issue_title}"
+        fut_mem = pool.submit(pine_query, repo, issue_number, mem_query_text, top_k=8)
+
+    key_candidates, repo_snap = fut_snap.result()
+
+    if fut_mem is not None:
         try:
-            mem_query_text = f"{run_req.get('stack')} | {run_req.get('language')} | {run_req.get('user_story')} | {issue_title}"
-            mem_matches = pine_query(repo, issue_number, mem_query_text, top_k=8)
-            memories = compact_memories(mem_matches)
+            memories = compact_memories(fut_mem.result())
         except Exception as e:
             memories = f"(memory disabled: {e})"
-
-    files = list_files(".")
-    key_candidates = [p for p in files if any(p.endswith(suf) for suf in [
-        "pyproject.toml", "requirements.txt", "package.json", "package-lock.json",
-        "pom.xml", "build.gradle", "gradlew", "go.mod",
-        ".sln", ".csproj",
-        "README.md", "Makefile", "pytest.ini", "tox.ini"
-    ])]
-    key_candidates = list(dict.fromkeys(key_candidates))[:60]
-    repo_snap = snapshot(key_candidates)
+    pool.shutdown(wait=False)
 
         # ✅ deja evidencia en agent/out
     write_out(
@@ -1156,10 +1295,9 @@ def main() -> None:
     )
     write_out(
         "agent/out/repo_snap_files_meta.json",
-        json.dumps(
+        _dumps(
             {"total_matched": len(key_candidates), "used_in_snapshot": len(key_candidates), "files": key_candidates},
-            ensure_ascii=False,
-            indent=2,
+            indent=True,
         )
     )
     planner_prompt = _load_prompt("design_agent.md")
@@ -1169,7 +1307,7 @@ def main() -> None:
     # Planner -> Plan (repair max 1)
     plan_raw = chat_json(
         system=planner_prompt,
-        user=json.dumps({
+        user=_dumps({
             "stack": run_req.get("stack"),
             "language": run_req.get("language"),
             "user_story": run_req.get("user_story"),
@@ -1179,8 +1317,9 @@ def main() -> None:
             "issue_title": issue_title,
             "issue_body": issue_body,
             "memories": memories
-        }, ensure_ascii=False),
+        }),
         schema_name="plan.schema.json",
+        schema=PLAN_SCHEMA,
     )
 
     plan = normalize_plan(plan_raw)
@@ -1212,18 +1351,9 @@ def main() -> None:
                 "Revisa agent/out/plan_invalid.json, plan_validation_error.txt, plan_repaired.json, plan_repair_failed.txt"
             ) from e2
 
-    pine_upsert_event(repo, issue_number, "plan", json.dumps(plan, ensure_ascii=False), {
-        "stack": run_req.get("stack"),
-        "language": run_req.get("language"),
-        "issue_title": issue_title,
-    })
-
     max_iterations = int(run_req.get("max_iterations", 2))
     base_branch = "main"
     branch_name = f"agent/issue-{issue_number}"
-    # Create or reuse the work branch (idempotent across reruns)
-    ensure_branch(branch_name, base=f"origin/{base_branch}")
-    write_out("agent/out/branch.txt", branch_name)
 
     pr_url = ""
     iteration_notes: List[str] = []
@@ -1231,287 +1361,316 @@ def main() -> None:
 
     last_failure_sig = ""
     stuck_count = 0
+    llm_pool = ThreadPoolExecutor(max_workers=1)
 
-    for i in range(1, max_iterations + 1):
-        prev_test_output = ""
-        if os.path.exists("agent/out/last_test_output.txt"):
-            prev_test_output = open(
-                "agent/out/last_test_output.txt",
-                "r",
-                encoding="utf-8",
-                errors="replace"
-            ).read()
-
-        prev_hints: List[str] = []
-        if os.path.exists("agent/out/failure_hints.json"):
-            try:
-                prev_hints = json.loads(
-                    open("agent/out/failure_hints.json", "r", encoding="utf-8").read()
-                )
-            except Exception:
-                prev_hints = []
-
-        # IMPLEMENT
-        patch_obj = chat_json(
-            system=impl_prompt,
-            user=json.dumps({
-                "iteration": i,
-                "stack": run_req.get("stack"),
-                "language": run_req.get("language"),
-                "user_story": run_req.get("user_story"),
-                "acceptance_criteria": run_req.get("acceptance_criteria", []),
-                "constraints": run_req.get("constraints", []),
-                "plan": plan,
-                "repo_snapshot": repo_snap,
-                "memories": memories,
-                "previous_test_output": prev_test_output,
-                "failure_hints": prev_hints,
-            }, ensure_ascii=False),
-            schema_name="patch.schema.json",
-        )
-
-        # DEBUG: patch crudo
-        write_out(
-            f"agent/out/iter_{i}_patch_from_llm.json",
-            json.dumps(patch_obj, ensure_ascii=False, indent=2),
-        )
+    # Memory events are buffered and flushed once in the finally below, so an exception in the
+    # loop still records them (single embedding + upsert round trip)
+    pending_upserts: List[Dict[str, Any]] = [
+        memory_event(issue_number, "plan", _dumps(plan)[:4000], {
+            "stack": run_req.get("stack"),
+            "language": run_req.get("language"),
+            "issue_title": issue_title,
+        })
+    ]
 
-        patch_obj = normalize_patch(patch_obj)
+    try:
+        # Create or reuse the work branch (idempotent across reruns)
+        ensure_branch(branch_name, base=f"origin/{base_branch}")
+        write_out("agent/out/branch.txt", branch_name)
+
+        for i in range(1, max_iterations + 1):
+            prev_test_output = ""
+            if os.path.exists("agent/out/last_test_output.txt"):
+                prev_test_output = _read_tail("agent/out/last_test_output.txt", PREV_TEST_OUTPUT_MAX_BYTES)
+
+            prev_hints: List[str] = []
+            if os.path.exists("agent/out/failure_hints.json"):
+                try:
+                    prev_hints = _loads(
+                        open("agent/out/failure_hints.json", "r", encoding="utf-8").read()
+                    )
+                except Exception:
+                    prev_hints = []
+
+            # IMPLEMENT
+            patch_obj = chat_json(
+                system=impl_prompt,
+                user=_dumps({
+                    "iteration": i,
+                    "stack": run_req.get("stack"),
+                    "language": run_req.get("language"),
+                    "user_story": run_req.get("user_story"),
+                    "acceptance_criteria": run_req.get("acceptance_criteria", []),
+                    "constraints": run_req.get("constraints", []),
+                    "plan": plan,
+                    # Snapshot completo en cada iteración: chat_json no guarda estado entre llamadas y
+                    # files{} reescribe archivos enteros, así que el modelo debe ver el contenido actual
+                    "repo_snapshot": repo_snap,
+                    "memories": memories,
+                    "previous_test_output": prev_test_output,
+                    "failure_hints": prev_hints,
+                }),
+                schema_name="patch.schema.json",
+                schema=PATCH_SCHEMA,
+            )
 
-        # Hard guard: no permitir patches vacíos
-        if "patches" in patch_obj and (not isinstance(patch_obj["patches"], list) or len(patch_obj["patches"]) == 0):
-            patch_obj.pop("patches", None)
+            # DEBUG: patch crudo
+            write_out(
+                f"agent/out/iter_{i}_patch_from_llm.json",
+                _dumps(patch_obj, indent=True),
+            )
 
-        safe_validate(patch_obj, PATCH_SCHEMA, "patch.schema.json")
+            patch_obj = normalize_patch(patch_obj)
 
-        apply_patch_object(patch_obj)
+            # Hard guard: no permitir patches vacíos
+            if "patches" in patch_obj and (not isinstance(patch_obj["patches"], list) or len(patch_obj["patches"]) == 0):
+                patch_obj.pop("patches", None)
 
-        # patch normalizado aplicado
-        write_out(f"agent/out/iter_{i}_patch.json", json.dumps(patch_obj, ensure_ascii=False, indent=2))
+            safe_validate(patch_obj, PATCH_SCHEMA, "patch.schema.json")
 
-        # Detect changes
-        changed_files = detect_repo_changes()
-        changed_text = "\n".join(changed_files)
-        write_out(f"agent/out/iter_{i}_changed_files.txt", changed_text)
+            apply_patch_object(patch_obj)
+            # The patch may add manifests/markers: memoized layout lookups must not outlive it
+            clear_detection_cache()
 
-        if not changed_files:
-            iteration_notes.append(f"Iteración {i}: sin cambios detectados (skip)")
-            continue
+            # patch normalizado aplicado
+            write_out(f"agent/out/iter_{i}_patch.json", _dumps(patch_obj, indent=True))
 
-        # -------------------------------
-        # ENTERPRISE POLICY: Financial Test Contract (multi-stack)
-        # Prohibir expected hardcodeado "manual/derivado" en tests financieros.
-        # Si se viola, revertimos cambios y forzamos al implementador a derivar expected por fórmula/helper.
-        # -------------------------------
-        policy = detect_financial_expected_antipattern(changed_files)
-        write_out(
-            f"agent/out/iter_{i}_policy_violation_financial_tests.json",
-            json.dumps(policy, ensure_ascii=False, indent=2),
-        )
+            # Detect changes
+            status_entries = git_status_entries()
+            changed_files = detect_repo_changes(status_entries)
+            changed_text = "\n".join(changed_files)
+            write_out(f"agent/out/iter_{i}_changed_files.txt", changed_text)
 
-        if policy.get("breaking"):
-            # Revertir cambios locales para no ensuciar la rama con commits malos
-            try:
-                subprocess.run(["git", "checkout", "--", "."], text=True, capture_output=True)
-                subprocess.run(["git", "clean", "-fd"], text=True, capture_output=True)
-            except Exception:
-                pass
+            if not changed_files:
+                iteration_notes.append(f"Iteración {i}: sin cambios detectados (skip)")
+                continue
 
-            msg = (
-                "POLICY VIOLATION: Tests financieros con expected hardcodeado marcado como 'manual/derivado'.\n"
-                "Regla enterprise: expected debe derivarse por fórmula estándar (helper en test) o usar un golden vector documentado.\n"
-                f"Ver evidencia: agent/out/iter_{i}_policy_violation_financial_tests.json\n"
-                "Sugerencia: en Python/pytest define una función helper expected_payment(...) con la fórmula y compara con pytest.approx.\n"
+            # -------------------------------
+            # ENTERPRISE POLICY: Financial Test Contract (multi-stack)
+            # Prohibir expected hardcodeado "manual/derivado" en tests financieros.
+            # Si se viola, revertimos cambios y forzamos al implementador a derivar expected por fórmula/helper.
+            # -------------------------------
+            policy = detect_financial_expected_antipattern(changed_files)
+            write_out(
+                f"agent/out/iter_{i}_policy_violation_financial_tests.json",
+                _dumps(policy, indent=True),
             )
-            write_out("agent/out/last_test_output.txt", msg)
-            write_out("agent/out/failure_hints.json", json.dumps([
-                "POLICY: No hardcodear expected 'manual/derivado' en tests financieros. Deriva expected por fórmula/helper o golden vector documentado.",
-                "Python/pytest: define expected_payment(principal, annual_rate, years_or_months) usando la fórmula de amortización y usa pytest.approx.",
-                "Si cambias unidad (years↔months), NO rompas contrato: crea v2 o wrapper compatible (API LOCK).",
-            ], ensure_ascii=False, indent=2))
-
-            iteration_notes.append(f"Iteración {i}: ❌ policy violation (financial expected hardcoded) -> reverted")
-            continue
-
-        # --- CONTRACT SNAPSHOT + API LOCK (enterprise, stack-agnostic by heuristics) ---
-        snap = generate_contract_snapshot(run_req)
-        write_out(f"agent/out/iter_{i}_contract_snapshot.json", json.dumps(snap, ensure_ascii=False, indent=2))
-        write_out("agent/out/contract_snapshot.json", json.dumps(snap, ensure_ascii=False, indent=2))
 
-        lock_path = "agent/out/contract_lock.json"
-        if not os.path.exists(lock_path):
-            # Initialize lock on first iteration that actually changes files.
-            # This prevents "years↔months" drift in later iterations.
-            write_out(lock_path, json.dumps(snap, ensure_ascii=False, indent=2))
-        else:
-            try:
-                lock = json.loads(open(lock_path, "r", encoding="utf-8").read())
-            except Exception:
-                lock = None
-
-            if isinstance(lock, dict):
-                violations = enforce_api_lock(lock, snap)
-                write_out(f"agent/out/iter_{i}_contract_violations.json", json.dumps(violations, ensure_ascii=False, indent=2))
-
-                if violations.get("breaking"):
-                    # Revert uncommitted changes to keep repo clean
-                    try:
-                        subprocess.run(["git", "checkout", "--", "."], text=True, capture_output=True)
-                        subprocess.run(["git", "clean", "-fd"], text=True, capture_output=True)
-                    except Exception:
-                        pass
-
-                    raise RuntimeError(
-                        f"Contract/API lock violado: se detectaron breaking changes (eliminación o cambio de firma/endpoint). "
-                        f"Revisa agent/out/iter_{i}_contract_violations.json. "
-                        "Política: solo cambios aditivos; si necesitas cambiar contrato, crea wrapper compatible o v2."
-                    )
-
-        # git status debug
-        _, status_porcelain = run_cmd("git status --porcelain")
-        write_out(f"agent/out/iter_{i}_git_status.txt", status_porcelain)
+            if policy.get("breaking"):
+                # Revertir cambios locales para no ensuciar la rama con commits malos
+                try:
+                    subprocess.run(["git", "checkout", "--", "."], text=True, capture_output=True)
+                    subprocess.run(["git", "clean", "-fd"], text=True, capture_output=True)
+                except Exception:
+                    pass
+
+                msg = (
+                    "POLICY VIOLATION: Tests financieros con expected hardcodeado marcado como 'manual/derivado'.\n"
+                    "Regla enterprise: expected debe derivarse por fórmula estándar (helper en test) o usar un golden vector documentado.\n"
+                    f"Ver evidencia: agent/out/iter_{i}_policy_violation_financial_tests.json\n"
+                    "Sugerencia: en Python/pytest define una función helper expected_payment(...) con la fórmula y compara con pytest.approx.\n"
+                )
+                write_out("agent/out/last_test_output.txt", msg)
+                write_out("agent/out/failure_hints.json", _dumps([
+                    "POLICY: No hardcodear expected 'manual/derivado' en tests financieros. Deriva expected por fórmula/helper o golden vector documentado.",
+                    "Python/pytest: define expected_payment(principal, annual_rate, years_or_months) usando la fórmula de amortización y usa pytest.approx.",
+                    "Si cambias unidad (years↔months), NO rompas contrato: crea v2 o wrapper compatible (API LOCK).",
+                ], indent=True))
+
+                iteration_notes.append(f"Iteración {i}: ❌ policy violation (financial expected hardcoded) -> reverted")
+                continue
 
-        git_commit_all(f"agent: implement issue {issue_number} (iter {i})")
+            # --- CONTRACT SNAPSHOT + API LOCK (enterprise, stack-agnostic by heuristics) ---
+            snap = generate_contract_snapshot(run_req)
+            write_out(f"agent/out/iter_{i}_contract_snapshot.json", _dumps(snap, indent=True))
+            write_out("agent/out/contract_snapshot.json", _dumps(snap, indent=True))
 
-        # RUN TESTS (sin shell)
-        test_cmd = run_req.get("test_command") or ""
-        test_exit, test_out = run_cmd(test_cmd)
+            lock_path = "agent/out/contract_lock.json"
+            if not os.path.exists(lock_path):
+                # Initialize lock on first iteration that actually changes files.
+                # This prevents "years↔months" drift in later iterations.
+                write_out(lock_path, _dumps(snap, indent=True))
+            else:
+                try:
+                    lock = _loads(open(lock_path, "r", encoding="utf-8").read())
+                except Exception:
+                    lock = None
+
+                if isinstance(lock, dict):
+                    violations = enforce_api_lock(lock, snap)
+                    write_out(f"agent/out/iter_{i}_contract_violations.json", _dumps(violations, indent=True))
+
+                    if violations.get("breaking"):
+                        # Revert uncommitted changes to keep repo clean
+                        try:
+                            subprocess.run(["git", "checkout", "--", "."], text=True, capture_output=True)
+                            subprocess.run(["git", "clean", "-fd"], text=True, capture_output=True)
+                        except Exception:
+                            pass
+
+                        raise RuntimeError(
+                            f"Contract/API lock violado: se detectaron breaking changes (eliminación o cambio de firma/endpoint). "
+                            f"Revisa agent/out/iter_{i}_contract_violations.json. "
+                            "Política: solo cambios aditivos; si necesitas cambiar contrato, crea wrapper compatible o v2."
+                        )
+
+            # The patch is kept (no policy/contract revert above): refresh only the snapshot entries it
+            # touched, so the next implement prompt matches the working tree; unchanged files are not re-read
+            touched = set(changed_files)
+            stale = [p for p in repo_snap if os.path.normpath(p) in touched]
+            if stale:
+                repo_snap.update(snapshot(stale))
+
+            # git status debug (same status used for change detection; no second git call)
+            write_out(f"agent/out/iter_{i}_git_status.txt", "\n".join(status_entries))
+
+            git_commit_all(f"agent: implement issue {issue_number} (iter {i})")
+
+            # RUN TESTS (sin shell)
+            test_cmd = run_req.get("test_command") or ""
+            test_exit, test_out = run_cmd_streamed(test_cmd)
+
+            telemetry = {}
+            effective_exit = int(test_exit)
+
+            # --- ENTERPRISE: meaningful-tests gate (esp. pytest exit=0 con skipped/0 tests) ---
+            if (run_req.get("language") or "").lower().strip() == "python":
+                telemetry = parse_pytest_telemetry(test_out)
+                write_out(f"agent/out/iter_{i}_test_telemetry.json", _dumps(telemetry, indent=True))
+
+                # Si pytest exit=0 pero no ejecutó tests "reales", forzar fallo lógico
+                no_meaningful = (telemetry.get("total", 0) == 0) or (
+                    telemetry.get("passed", 0) == 0 and telemetry.get("failed", 0) == 0 and telemetry.get("errors", 0) == 0
+                )
+                if effective_exit == 0 and no_meaningful:
+                    effective_exit = 2  # consistente con "test failures"
+                    test_out = (test_out or "") + "\n\n[enterprise] No meaningful tests executed (all skipped or none collected). Treating as failure.\n"
 
-        telemetry = {}
-        effective_exit = int(test_exit)
+            # usar effective_exit desde aquí en adelante
+            test_exit = effective_exit
 
-        # --- ENTERPRISE: meaningful-tests gate (esp. pytest exit=0 con skipped/0 tests) ---
-        if (run_req.get("language") or "").lower().strip() == "python":
-            telemetry = parse_pytest_telemetry(test_out)
-            write_out(f"agent/out/iter_{i}_test_telemetry.json", json.dumps(telemetry, ensure_ascii=False, indent=2))
+            # Persist both per-iteration and "last" for convenience
+            write_out(f"agent/out/iter_{i}_test_output.txt", test_out)
+            write_out("agent/out/last_test_output.txt", test_out)
 
-            # Si pytest exit=0 pero no ejecutó tests "reales", forzar fallo lógico
-            no_meaningful = (telemetry.get("total", 0) == 0) or (
-                telemetry.get("passed", 0) == 0 and telemetry.get("failed", 0) == 0 and telemetry.get("errors", 0) == 0
-            )
-            if effective_exit == 0 and no_meaningful:
-                effective_exit = 2  # consistente con "test failures"
-                test_out = (test_out or "") + "\n\n[enterprise] No meaningful tests executed (all skipped or none collected). Treating as failure.\n"
-
-        # usar effective_exit desde aquí en adelante
-        test_exit = effective_exit
-
-        # Persist both per-iteration and "last" for convenience
-        write_out(f"agent/out/iter_{i}_test_output.txt", test_out)
-        write_out("agent/out/last_test_output.txt", test_out)
-
-        # --- ENTERPRISE: Java test discovery (Surefire) ---
-        if str(run_req.get("stack") or "").startswith("java-") or (run_req.get("language") or "").lower() == "java":
-            surefire = discover_maven_surefire_tests()
-            write_out(f"agent/out/iter_{i}_surefire.json", json.dumps(surefire, ensure_ascii=False, indent=2))
-
-            # Optional: detect if the agent-created tests actually ran
-            expected_tests = []
-            files_map = patch_obj.get("files") if isinstance(patch_obj.get("files"), dict) else {}
-            for pth in files_map.keys():
-                p_norm = pth.strip()
-                if p_norm.startswith("./"):
-                    p_norm = p_norm[2:]
-                p_norm = os.path.normpath(p_norm)
-                if p_norm.startswith(os.path.join("src", "test", "java")) and p_norm.endswith(".java"):
-                    # map path -> FQN guess: src/test/java/a/b/C.java => a.b.C
-                    rel = p_norm[len(os.path.join("src", "test", "java")) + 1 :]
-                    fqn = rel[:-5].replace(os.sep, ".")
-                    expected_tests.append(fqn)
-
-            if expected_tests:
-                ran_classes = set(surefire.get("classes") or [])
-                missing = [t for t in expected_tests if t not in ran_classes]
-                write_out(
-                    f"agent/out/iter_{i}_expected_tests.json",
-                    json.dumps({"expected": expected_tests, "missing_in_surefire": missing}, ensure_ascii=False, indent=2),
+            # FAILURE HINTS
+            try:
+                meta = fh_classify_failure(
+                    test_out,
+                    language=language,
+                    stack=str(run_req.get("stack") or ""),
                 )
-
-        # FAILURE HINTS
-        try:
-            meta = fh_classify_failure(
-                test_out,
-                language=language,
-                stack=str(run_req.get("stack") or ""),
+                hints = summarize_hints(meta)
+                write_out("agent/out/failure_hints.json", _dumps(hints, indent=True))
+            except Exception:
+                hints = []
+
+            # TEST AGENT: la llamada al LLM corre en llm_pool mientras se hace el trabajo local
+            # (surefire, memoria, firma de fallo); se resuelve antes de decidir early stop
+            fut_report = llm_pool.submit(
+                chat_json,
+                system=test_prompt,
+                user=_dumps({
+                    "stack": run_req.get("stack"),
+                    "language": run_req.get("language"),
+                    "user_story": run_req.get("user_story"),
+                    "acceptance_criteria": run_req.get("acceptance_criteria", []),
+                    "constraints": run_req.get("constraints", []),
+                    "plan": plan,
+                    "test_command": test_cmd,
+                    "test_exit": test_exit,
+                    "test_output": test_out[:12000],
+                    "failure_hints": hints,
+                }),
+                schema_name="test_report.schema.json",
+                schema=TEST_SCHEMA,
             )
-            hints = summarize_hints(meta)
-            write_out("agent/out/failure_hints.json", json.dumps(hints, ensure_ascii=False, indent=2))
-        except Exception:
-            hints = []
-
-        # Pinecone upsert after tests
-        pine_upsert_event(
-            repo,
-            issue_number,
-            "iteration",
-            f"iter={i}\nchanged_files=\n{changed_text}\n\nexit={test_exit}\n\n{test_out[:4000]}",
-            {
-                "iteration": i,
-                "exit": int(test_exit),
-                "changed_files_count": len(changed_files),
-                "stack": run_req.get("stack"),
-                "language": run_req.get("language"),
-            }
-        )
-
-        # TEST AGENT
-        tr = chat_json(
-            system=test_prompt,
-            user=json.dumps({
-                "stack": run_req.get("stack"),
-                "language": run_req.get("language"),
-                "user_story": run_req.get("user_story"),
-                "acceptance_criteria": run_req.get("acceptance_criteria", []),
-                "constraints": run_req.get("constraints", []),
-                "plan": plan,
-                "test_command": test_cmd,
-                "test_exit": test_exit,
-                "test_output": test_out[:12000],
-                "failure_hints": hints,
-            }, ensure_ascii=False),
-            schema_name="test_report.schema.json",
-        )
-
-        test_report = normalize_test_report(tr, run_req)
-        safe_validate(test_report, TEST_SCHEMA, "test_report.schema.json")
 
-        # -------------------------------
-        # ENTERPRISE: Early stop on success
-        # Avoid regressions by continuing to iterate after tests already pass.
-        # This is stack-agnostic.
-        # -------------------------------
-        try:
-            passed = bool(test_report.get("passed", False))
-        except Exception:
-            passed = False
+            # --- ENTERPRISE: Java test discovery (Surefire) ---
+            if str(run_req.get("stack") or "").startswith("java-") or (run_req.get("language") or "").lower() == "java":
+                surefire = discover_maven_surefire_tests()
+                write_out(f"agent/out/iter_{i}_surefire.json", _dumps(surefire, indent=True))
+
+                # Optional: detect if the agent-created tests actually ran
+                expected_tests = []
+                files_map = patch_obj.get("files") if isinstance(patch_obj.get("files"), dict) else {}
+                for pth in files_map.keys():
+                    p_norm = pth.strip()
+                    if p_norm.startswith("./"):
+                        p_norm = p_norm[2:]
+                    p_norm = os.path.normpath(p_norm)
+                    if p_norm.startswith(os.path.join("src", "test", "java")) and p_norm.endswith(".java"):
+                        # map path -> FQN guess: src/test/java/a/b/C.java => a.b.C
+                        rel = p_norm[len(os.path.join("src", "test", "java")) + 1 :]
+                        fqn = rel[:-5].replace(os.sep, ".")
+                        expected_tests.append(fqn)
+
+                if expected_tests:
+                    ran_classes = set(surefire.get("classes") or [])
+                    missing = [t for t in expected_tests if t not in ran_classes]
+                    write_out(
+                        f"agent/out/iter_{i}_expected_tests.json",
+                        _dumps({"expected": expected_tests, "missing_in_surefire": missing}, indent=True),
+                    )
 
-        ac_status = test_report.get("acceptance_criteria_status", [])
-        all_met = False
-        if isinstance(ac_status, list) and ac_status:
-            all_met = all(bool(x.get("met", False)) for x in ac_status if isinstance(x, dict))
-        else:
-            # If no AC provided, treat "passed" as sufficient
-            all_met = True
+            # Pinecone memory (flushed in the finally below). Tail, not head: pytest/mvn put
+            # the failure summary at the end of the output.
+            test_out_tail = test_out[-4000:]
+            pending_upserts.append(memory_event(
+                issue_number,
+                "iteration",
+                f"iter={i}\nchanged_files=\n{changed_text}\n\nexit={test_exit}\n\n{test_out_tail}",
+                {
+                    "iteration": i,
+                    "exit": int(test_exit),
+                    "changed_files_count": len(changed_files),
+                    "stack": run_req.get("stack"),
+                    "language": run_req.get("language"),
+                }
+            ))
+
+            failure_sig = stable_failure_signature(test_exit, test_out)
+
+            test_report = finalize_test_report(fut_report.result(), run_req)
+
+            # -------------------------------
+            # ENTERPRISE: Early stop on success
+            # Avoid regressions by continuing to iterate after tests already pass.
+            # This is stack-agnostic.
+            # -------------------------------
+            try:
+                passed = bool(test_report.get("passed", False))
+            except Exception:
+                passed = False
 
-        if int(test_exit) == 0 and passed and all_met:
-            iteration_notes.append(f"Iteración {i}: ✅ passed (early stop)")
-            break
+            ac_status = test_report.get("acceptance_criteria_status", [])
+            all_met = False
+            if isinstance(ac_status, list) and ac_status:
+                all_met = all(bool(x.get("met", False)) for x in ac_status if isinstance(x, dict))
+            else:
+                # If no AC provided, treat "passed" as sufficient
+                all_met = True
 
-        iteration_notes.append(f"Iteración {i}: test exit={test_exit} passed={bool(test_report.get('passed', False))}")
+            if int(test_exit) == 0 and passed and all_met:
+                iteration_notes.append(f"Iteración {i}: ✅ passed (early stop)")
+                break
 
-        failure_sig = stable_failure_signature(test_exit, test_out)
+            iteration_notes.append(f"Iteración {i}: test exit={test_exit} passed={bool(test_report.get('passed', False))}")
 
-        try:
-            stuck = should_count_as_stuck(last_failure_sig, failure_sig, changed_text)
-        except TypeError:
-            stuck = should_count_as_stuck(last_failure_sig, failure_sig)
+            try:
+                stuck = should_count_as_stuck(last_failure_sig, failure_sig, changed_text)
+            except TypeError:
+                stuck = should_count_as_stuck(last_failure_sig, failure_sig)
 
-        if stuck:
-            stuck_count += 1
-        else:
-            stuck_count = 0
+            if stuck:
+                stuck_count += 1
+            else:
+                stuck_count = 0
 
-        last_failure_sig = failure_sig
+            last_failure_sig = failure_sig
+    finally:
+        llm_pool.shutdown(wait=False)
+        pine_upsert_events(repo, issue_number, pending_upserts)
 
     # -------------------------------
     # ENTERPRISE: Create PR when there are commits
@@ -1539,16 +1698,14 @@ def main() -> None:
 
     write_out("agent/out/pr_url.txt", pr_url or "")
 
-    summary_md = render_summary_md(issue_title, pr_url, iteration_notes, test_report)
-    write_out("agent/out/summary.md", summary_md)
+    # Stream the summary straight into the file instead of building the whole string first
+    with _open_out("agent/out/summary.md", buffering=1 << 16) as f:
+        write_summary_md(f, issue_title, pr_url, iteration_notes, test_report)
 
 
 if __name__ == "__main__":
     try:
         main()
     except Exception as e:
-        msg = f"❌ Orchestrator error: {e}"
-        os.makedirs("agent/out", exist_ok=True)
-        with open("agent/out/summary.md", "w", encoding="utf-8", errors="replace") as f:
-            f.write(msg + "\n")
+        write_out("agent/out/summary.md", f"❌ Orchestrator error: {e}")
         raise
@@ -16,7 +16,11 @@ from __future__ import annotations
 
 import glob
 import os
-from typing import Any, Dict, List, Tuple
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Pattern, Tuple
+
+from agent.stacks.plugins._walk import SKIP
 
 
 def catalog_stacks_view(catalog: Dict[str, Any]) -> Dict[str, Any]:
@@ -35,46 +39,188 @@ def catalog_entry(catalog: Dict[str, Any], stack_id: str) -> Dict[str, Any]:
     return entry if isinstance(entry, dict) else {}
 
 
+def _markers_any_of(entry: Dict[str, Any]) -> List[Any]:
+    """entry["markers"]["any_of"] when well-formed, else []: one lookup and type check per stack."""
+    markers = entry.get("markers")
+    if not isinstance(markers, dict):
+        return []
+    any_of = markers.get("any_of")
+    return any_of if isinstance(any_of, list) else []
+
+
+@lru_cache(maxsize=8)
+def _repo_paths(abs_root: str) -> Tuple[str, ...]:
+    """
+    Every path under abs_root (relative, "/"-separated) from a single os.scandir walk.
+    Dirent types avoid a stat per entry and SKIP dirs (.git, node_modules, build outputs) are pruned.
+    Markers are evaluated before anything writes to the repo, so the walk is memoized per process;
+    clear_repo_paths_cache() resets it.
+    """
+    out: List[str] = []
+    pending = [("", abs_root)]
+    while pending:
+        rel_dir, current = pending.pop()
+        try:
+            it = os.scandir(current)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                rel = rel_dir + entry.name
+                out.append(rel)
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if is_dir and entry.name not in SKIP:
+                    pending.append((rel + "/", entry.path))
+    return tuple(out)
+
+
+def clear_repo_paths_cache() -> None:
+    _repo_paths.cache_clear()
+
+
+def _glob_segment_regex(seg: str) -> str:
+    # Like glob: wildcards never cross "/" and a leading wildcard does not match dotfiles.
+    out = [] if seg.startswith(".") else [r"(?!\.)"]
+    i = 0
+    while i < len(seg):
+        c = seg[i]
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[" and seg.find("]", i + 2) > 0:
+            j = seg.find("]", i + 2)
+            body = seg[i + 1:j].replace("\\", "\\\\")
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            out.append(f"[{body}]")
+            i = j
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+@lru_cache(maxsize=256)
+def _glob_regex_src(pattern: str) -> str:
+    """Translate a recursive glob ("**/pom.xml", "*/settings.py") into regex source over relative paths."""
+    parts: List[str] = []
+    segs = pattern.split("/")
+    for i, seg in enumerate(segs):
+        last = i == len(segs) - 1
+        if seg == "**" and last:
+            # trailing "**": the parent itself plus its whole non-hidden subtree
+            if parts:
+                parts[-1] = parts[-1][:-1]
+                parts.append(r"(?:/[^/.][^/]*)*")
+            else:
+                parts.append(r"[^/.][^/]*(?:/[^/.][^/]*)*")
+        elif seg == "**":
+            # zero or more non-hidden directories
+            parts.append(r"(?:[^/.][^/]*/)*")
+        else:
+            parts.append(_glob_segment_regex(seg) + ("" if last else "/"))
+    return "".join(parts)
+
+
+@lru_cache(maxsize=256)
+def _glob_regex(pattern: str) -> Pattern[str]:
+    return re.compile(_glob_regex_src(pattern) + r"\Z")
+
+
+@lru_cache(maxsize=64)
+def _combined_glob_regex(patterns: Tuple[str, ...]) -> Pattern[str]:
+    """One alternation for a whole any_of list: a single regex pass per path instead of one per pattern."""
+    return re.compile("(?:" + "|".join(_glob_regex_src(p) for p in patterns) + r")\Z")
+
+
+def _normalize_glob(pattern: str) -> str:
+    pat = pattern.strip()
+    while pat.startswith("./"):
+        pat = pat[2:]
+    return pat
+
+
+def _outside_walk(pat: str) -> bool:
+    return os.path.isabs(pat) or ".." in pat.split("/")
+
+
+def _iter_glob(pattern: str, repo_root: str = ".") -> Iterator[str]:
+    pat = _normalize_glob(pattern)
+    if _outside_walk(pat):
+        # Outside the walked tree: let glob handle it.
+        yield from glob.glob(os.path.join(repo_root, pat), recursive=True)
+        return
+    rx = _glob_regex(pat)
+    for rel in _repo_paths(os.path.abspath(repo_root)):
+        if rx.match(rel):
+            yield os.path.join(repo_root, rel)
+
+
 def _glob_many(patterns: List[str], repo_root: str = ".") -> List[str]:
     out: List[str] = []
     for pat in patterns or []:
         if not isinstance(pat, str) or not pat.strip():
             continue
         try:
-            out.extend(glob.glob(os.path.join(repo_root, pat), recursive=True))
+            out.extend(_iter_glob(pat, repo_root=repo_root))
         except Exception:
             continue
-    # unique, stable
+    # unique, insertion-ordered (no caller depends on sorted paths)
     seen = set()
     uniq: List[str] = []
     for p in out:
         if p and p not in seen:
             seen.add(p)
             uniq.append(p)
-    return sorted(uniq)
+    return uniq
+
+
+def _glob_matches_any(pattern: Any, repo_root: str = ".") -> bool:
+    if not isinstance(pattern, str) or not pattern.strip():
+        return False
+    try:
+        return next(_iter_glob(pattern, repo_root=repo_root), None) is not None
+    except Exception:
+        return False
 
 
 def exists_any_glob(patterns: List[str], repo_root: str = ".") -> bool:
+    walkable: List[str] = []
     for pat in patterns or []:
-        if _glob_many([pat], repo_root=repo_root):
-            return True
-    return False
+        if not isinstance(pat, str) or not pat.strip():
+            continue
+        norm = _normalize_glob(pat)
+        if _outside_walk(norm):
+            if _glob_matches_any(norm, repo_root=repo_root):
+                return True
+        elif norm not in walkable:
+            walkable.append(norm)
+    if not walkable:
+        return False
+    try:
+        rx = _combined_glob_regex(tuple(walkable))
+    except re.error:
+        return any(_glob_matches_any(p, repo_root=repo_root) for p in walkable)
+    return any(rx.match(rel) for rel in _repo_paths(os.path.abspath(repo_root)))
 
 
 def marker_score(patterns: List[str], repo_root: str = ".") -> int:
     """Simple score: number of marker patterns that match at least one file."""
     score = 0
     for pat in patterns or []:
-        if _glob_many([pat], repo_root=repo_root):
+        if _glob_matches_any(pat, repo_root=repo_root):
             score += 1
     return score
 
 
 def markers_found_for_stack(catalog: Dict[str, Any], stack_id: str, repo_root: str = ".") -> bool:
     entry = catalog_entry(catalog, stack_id)
-    markers = entry.get("markers") if isinstance(entry.get("markers"), dict) else {}
-    any_of = markers.get("any_of") or []
-    if not isinstance(any_of, list) or not any_of:
+    any_of = _markers_any_of(entry)
+    if not any_of:
         return False
     return exists_any_glob(any_of, repo_root=repo_root)
 
@@ -83,14 +229,34 @@ def repo_has_any_stack_markers(catalog: Dict[str, Any], repo_root: str = ".") ->
     stacks = catalog_stacks_view(catalog)
     if not isinstance(stacks, dict):
         return False
+    # Only "any marker anywhere" matters: one combined match over the union of all patterns
+    all_pats: List[str] = []
     for _sid, entry in stacks.items():
         if not isinstance(entry, dict):
             continue
-        markers = entry.get("markers") if isinstance(entry.get("markers"), dict) else {}
-        any_of = markers.get("any_of") or []
-        if isinstance(any_of, list) and any_of and exists_any_glob(any_of, repo_root=repo_root):
-            return True
-    return False
+        for p in _markers_any_of(entry):
+            if p not in all_pats:
+                all_pats.append(p)
+    return exists_any_glob(all_pats, repo_root=repo_root)
+
+
+def scan_markers(catalog: Dict[str, Any], repo_root: str = ".") -> Dict[str, bool]:
+    """
+    {stack_id -> any marker found} for every stack declaring markers.any_of.
+    Each stack's patterns run as one combined regex over the shared repo walk, so callers
+    can answer markers_found/repo_has_any questions with dict lookups.
+    """
+    stacks = catalog_stacks_view(catalog)
+    if not isinstance(stacks, dict):
+        return {}
+    per_stack: Dict[str, List[str]] = {}
+    for sid, entry in stacks.items():
+        if not isinstance(entry, dict):
+            continue
+        any_of = _markers_any_of(entry)
+        if any_of:
+            per_stack[sid] = any_of
+    return {sid: exists_any_glob(pats, repo_root=repo_root) for sid, pats in per_stack.items()}
 
 
 def bootstrap_kind_for_stack(catalog: Dict[str, Any], stack_id: str) -> str:
@@ -127,9 +293,8 @@ def auto_detect_stack_id(
         if preferred_language and lang and lang != preferred_language:
             continue
 
-        markers = entry.get("markers") if isinstance(entry.get("markers"), dict) else {}
-        any_of = markers.get("any_of") or []
-        if not isinstance(any_of, list) or not any_of:
+        any_of = _markers_any_of(entry)
+        if not any_of:
             continue
 
         s = marker_score(any_of, repo_root=repo_root)
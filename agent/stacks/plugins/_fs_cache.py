@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+import os
+from functools import lru_cache
+from typing import Optional
+
+from agent.stacks.spec import RepoScan
+
+
+@lru_cache(maxsize=512)
+def isfile(path: str) -> bool:
+    """
+    Memoized os.path.isfile (a single stat, no Path objects) for plugin marker checks (pom.xml, package.json, ...).
+    detect/default_commands/compute_meta probe the same files during one resolve;
+    registry.clear_detection_cache() resets it (with the other layout memos) when the repo layout changes.
+    """
+    return os.path.isfile(path)
+
+
+def has_marker(repo_root: str, name: str, scan: Optional[RepoScan] = None) -> bool:
+    """Root marker check answered from the shared RepoScan when available, else via isfile()."""
+    if scan is not None:
+        return scan.has(name)
+    return isfile(os.path.join(repo_root, name))
+
+
+def clear_fs_cache() -> None:
+    isfile.cache_clear()
@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+import os
+from typing import AbstractSet, Iterable
+
+# Vendored, virtualenv, VCS and build-output directories: never part of the project sources.
+SKIP: AbstractSet[str] = frozenset({
+    ".git", ".hg", ".svn",
+    ".venv", "venv", "env",
+    "node_modules", "__pycache__",
+    "dist", "build", "target", "bin", "obj",
+    ".tox", ".mypy_cache", ".pytest_cache",
+})
+
+
+def has_ext(root: str, exts: Iterable[str], skip: AbstractSet[str] = SKIP) -> bool:
+    """True as soon as a file with one of `exts` (e.g. ".py") is found under root, pruning `skip` dirs."""
+    wanted = tuple(exts)
+    for _dirpath, dirs, files in os.walk(root, followlinks=False):
+        dirs[:] = [d for d in dirs if d not in skip]
+        for name in files:
+            if os.path.splitext(name)[1] in wanted:
+                return True
+    return False
@@ -1,9 +1,9 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, Optional, Tuple
 
-from agent.stacks.spec import CommandSpec
+from agent.stacks.spec import CommandSpec, RepoScan
 
 
 class StackPlugin(ABC):
@@ -12,8 +12,8 @@ class StackPlugin(ABC):
         ...
 
     @abstractmethod
-    def detect(self, repo_root: str) -> Tuple[float, str]:
-        """Return (confidence 0..1, language)."""
+    def detect(self, repo_root: str, scan: Optional[RepoScan] = None) -> Tuple[float, str]:
+        """Return (confidence 0..1, language). Uses `scan` when given instead of walking the repo."""
         ...
 
     @abstractmethod
@@ -25,12 +25,12 @@ class StackPlugin(ABC):
         ...
 
     @abstractmethod
-    def default_commands(self, repo_root: str, language: str) -> CommandSpec:
+    def default_commands(self, repo_root: str, language: str, scan: Optional[RepoScan] = None) -> CommandSpec:
         ...
 
     @abstractmethod
     def allowed_test_prefixes(self, language: str) -> list[str]:
         ...
 
-    def compute_meta(self, repo_root: str, language: str) -> Dict[str, Any]:
+    def compute_meta(self, repo_root: str, language: str, scan: Optional[RepoScan] = None) -> Dict[str, Any]:
         return {}
@@ -1,21 +1,26 @@
 from __future__ import annotations
 
-from pathlib import Path
-from typing import Tuple
+from typing import Optional, Tuple
 
+from agent.stacks.plugins._walk import has_ext
 from agent.stacks.plugins.base import StackPlugin
-from agent.stacks.spec import CommandSpec
+from agent.stacks.spec import CommandSpec, RepoScan
 
 
 class DotnetPlugin(StackPlugin):
     def supports(self, language: str) -> bool:
         return language in ("dotnet", "csharp")
 
-    def detect(self, repo_root: str) -> Tuple[float, str]:
-        root = Path(repo_root)
-        if list(root.glob("**/*.sln")) or list(root.glob("**/*.csproj")):
+    def detect(self, repo_root: str, scan: Optional[RepoScan] = None) -> Tuple[float, str]:
+        if scan is not None:
+            if scan.has_ext(".sln") or scan.has_ext(".csproj"):
+                return 0.95, "dotnet"
+            if scan.has_ext(".cs"):
+                return 0.6, "dotnet"
+            return 0.0, ""
+        if has_ext(repo_root, (".sln", ".csproj")):
             return 0.95, "dotnet"
-        if list(root.glob("**/*.cs")):
+        if has_ext(repo_root, (".cs",)):
             return 0.6, "dotnet"
         return 0.0, ""
 
@@ -25,7 +30,7 @@ class DotnetPlugin(StackPlugin):
     def default_toolchain_version(self, language: str) -> str:
         return "8.0.x"
 
-    def default_commands(self, repo_root: str, language: str) -> CommandSpec:
+    def default_commands(self, repo_root: str, language: str, scan: Optional[RepoScan] = None) -> CommandSpec:
         return CommandSpec(test="dotnet test", build="dotnet build")
 
     def allowed_test_prefixes(self, language: str) -> list[str]:
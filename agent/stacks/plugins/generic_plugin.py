@@ -1,9 +1,9 @@
 from __future__ import annotations
 
-from typing import Tuple
+from typing import Optional, Tuple
 
 from agent.stacks.plugins.base import StackPlugin
-from agent.stacks.spec import CommandSpec
+from agent.stacks.spec import CommandSpec, RepoScan
 
 
 class GenericPlugin(StackPlugin):
@@ -12,7 +12,7 @@ class GenericPlugin(StackPlugin):
     def supports(self, language: str) -> bool:
         return True
 
-    def detect(self, repo_root: str) -> Tuple[float, str]:
+    def detect(self, repo_root: str, scan: Optional[RepoScan] = None) -> Tuple[float, str]:
         # Low confidence fallback.
         return 0.01, ""
 
@@ -22,7 +22,7 @@ class GenericPlugin(StackPlugin):
     def default_toolchain_version(self, language: str) -> str:
         return ""
 
-    def default_commands(self, repo_root: str, language: str) -> CommandSpec:
+    def default_commands(self, repo_root: str, language: str, scan: Optional[RepoScan] = None) -> CommandSpec:
         return CommandSpec(test="")
 
     def allowed_test_prefixes(self, language: str) -> list[str]:
@@ -1,21 +1,28 @@
 from __future__ import annotations
 
-from pathlib import Path
-from typing import Tuple
+import os
+from typing import Optional, Tuple
 
+from agent.stacks.plugins._fs_cache import isfile
+from agent.stacks.plugins._walk import has_ext
 from agent.stacks.plugins.base import StackPlugin
-from agent.stacks.spec import CommandSpec
+from agent.stacks.spec import CommandSpec, RepoScan
 
 
 class GoPlugin(StackPlugin):
     def supports(self, language: str) -> bool:
         return language == "go"
 
-    def detect(self, repo_root: str) -> Tuple[float, str]:
-        root = Path(repo_root)
-        if (root / "go.mod").exists():
+    def detect(self, repo_root: str, scan: Optional[RepoScan] = None) -> Tuple[float, str]:
+        if scan is not None:
+            if scan.has("go.mod"):
+                return 0.95, "go"
+            if scan.has_ext(".go"):
+                return 0.6, "go"
+            return 0.0, ""
+        if isfile(os.path.join(repo_root, "go.mod")):
             return 0.95, "go"
-        if list(root.glob("**/*.go")):
+        if has_ext(repo_root, (".go",)):
             return 0.6, "go"
         return 0.0, ""
 
@@ -25,7 +32,7 @@ class GoPlugin(StackPlugin):
     def default_toolchain_version(self, language: str) -> str:
         return "1.22.x"
 
-    def default_commands(self, repo_root: str, language: str) -> CommandSpec:
+    def default_commands(self, repo_root: str, language: str, scan: Optional[RepoScan] = None) -> CommandSpec:
         return CommandSpec(test="go test ./...")
 
     def allowed_test_prefixes(self, language: str) -> list[str]:
@@ -1,21 +1,28 @@
 from __future__ import annotations
 
-from pathlib import Path
-from typing import Any, Dict, Tuple
+import os
+from typing import Any, Dict, Optional, Tuple
 
+from agent.stacks.plugins._fs_cache import has_marker, isfile
+from agent.stacks.plugins._walk import has_ext
 from agent.stacks.plugins.base import StackPlugin
-from agent.stacks.spec import CommandSpec
+from agent.stacks.spec import CommandSpec, RepoScan
 
 
 class JavaPlugin(StackPlugin):
     def supports(self, language: str) -> bool:
         return language == "java"
 
-    def detect(self, repo_root: str) -> Tuple[float, str]:
-        root = Path(repo_root)
-        if (root / "pom.xml").exists() or (root / "gradlew").exists():
+    def detect(self, repo_root: str, scan: Optional[RepoScan] = None) -> Tuple[float, str]:
+        if scan is not None:
+            if scan.has("pom.xml") or scan.has("gradlew"):
+                return 0.95, "java"
+            if scan.has_ext(".java"):
+                return 0.6, "java"
+            return 0.0, ""
+        if isfile(os.path.join(repo_root, "pom.xml")) or isfile(os.path.join(repo_root, "gradlew")):
             return 0.95, "java"
-        if list(root.glob("**/*.java")):
+        if has_ext(repo_root, (".java",)):
             return 0.6, "java"
         return 0.0, ""
 
@@ -25,11 +32,10 @@ class JavaPlugin(StackPlugin):
     def default_toolchain_version(self, language: str) -> str:
         return "21"
 
-    def default_commands(self, repo_root: str, language: str) -> CommandSpec:
-        root = Path(repo_root)
-        if (root / "pom.xml").exists():
+    def default_commands(self, repo_root: str, language: str, scan: Optional[RepoScan] = None) -> CommandSpec:
+        if has_marker(repo_root, "pom.xml", scan):
             return CommandSpec(test="mvn -q test", build="mvn -q -DskipTests package")
-        if (root / "gradlew").exists():
+        if has_marker(repo_root, "gradlew", scan):
             return CommandSpec(test="./gradlew -q test", build="./gradlew -q assemble")
         return CommandSpec(test="mvn -q test")
 
@@ -41,7 +47,11 @@ class JavaPlugin(StackPlugin):
             "./gradlew -q test",
         ]
 
-    def compute_meta(self, repo_root: str, language: str) -> Dict[str, Any]:
-        root = Path(repo_root)
-        build_tool = "maven" if (root / "pom.xml").exists() else ("gradle" if (root / "gradlew").exists() else "")
+    def compute_meta(self, repo_root: str, language: str, scan: Optional[RepoScan] = None) -> Dict[str, Any]:
+        if has_marker(repo_root, "pom.xml", scan):
+            build_tool = "maven"
+        elif has_marker(repo_root, "gradlew", scan):
+            build_tool = "gradle"
+        else:
+            build_tool = ""
         return {"java_build_tool": build_tool}
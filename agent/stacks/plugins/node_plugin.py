@@ -1,25 +1,36 @@
 from __future__ import annotations
 
-from pathlib import Path
-from typing import Any, Dict, Tuple
+import os
+from typing import Any, Dict, Optional, Set, Tuple
 
+from agent.stacks.plugins._walk import has_ext
 from agent.stacks.plugins.base import StackPlugin
-from agent.stacks.spec import CommandSpec
+from agent.stacks.spec import CommandSpec, RepoScan
 
 
 class NodePlugin(StackPlugin):
     def supports(self, language: str) -> bool:
         return language in ("javascript", "typescript")
 
-    def detect(self, repo_root: str) -> Tuple[float, str]:
-        root = Path(repo_root)
-        if (root / "package.json").exists():
-            if (root / "tsconfig.json").exists() or list(root.glob("**/*.ts")):
+    def detect(self, repo_root: str, scan: Optional[RepoScan] = None) -> Tuple[float, str]:
+        if scan is not None:
+            if scan.has("package.json"):
+                if scan.has("tsconfig.json") or scan.has_ext(".ts"):
+                    return 0.95, "typescript"
+                return 0.95, "javascript"
+            if scan.has_ext(".ts"):
+                return 0.6, "typescript"
+            if scan.has_ext(".js"):
+                return 0.5, "javascript"
+            return 0.0, ""
+        entries = self._top_level(repo_root)
+        if "package.json" in entries:
+            if "tsconfig.json" in entries or has_ext(repo_root, (".ts",)):
                 return 0.95, "typescript"
             return 0.95, "javascript"
-        if list(root.glob("**/*.ts")):
+        if has_ext(repo_root, (".ts",)):
             return 0.6, "typescript"
-        if list(root.glob("**/*.js")):
+        if has_ext(repo_root, (".js",)):
             return 0.5, "javascript"
         return 0.0, ""
 
@@ -29,8 +40,8 @@ class NodePlugin(StackPlugin):
     def default_toolchain_version(self, language: str) -> str:
         return "20"
 
-    def default_commands(self, repo_root: str, language: str) -> CommandSpec:
-        pm = self._package_manager(Path(repo_root))
+    def default_commands(self, repo_root: str, language: str, scan: Optional[RepoScan] = None) -> CommandSpec:
+        pm = self._package_manager(scan.top_level if scan is not None else self._top_level(repo_root))
         if pm:
             return CommandSpec(test=f"{pm} test")
         return CommandSpec(test="npm test")
@@ -44,19 +55,25 @@ class NodePlugin(StackPlugin):
             "yarn test",
         ]
 
-    def compute_meta(self, repo_root: str, language: str) -> Dict[str, Any]:
-        root = Path(repo_root)
-        pm = self._package_manager(root) or "npm"
+    def compute_meta(self, repo_root: str, language: str, scan: Optional[RepoScan] = None) -> Dict[str, Any]:
+        pm = self._package_manager(scan.top_level if scan is not None else self._top_level(repo_root)) or "npm"
         return {"package_manager": pm}
 
     @staticmethod
-    def _package_manager(root: Path) -> str:
-        if (root / "pnpm-lock.yaml").exists():
+    def _top_level(repo_root: str) -> Set[str]:
+        """Names at the repo root from a single scandir (package.json, lockfiles, tsconfig.json)."""
+        try:
+            with os.scandir(repo_root) as it:
+                return {e.name for e in it}
+        except OSError:
+            return set()
+
+    @staticmethod
+    def _package_manager(entries: Set[str]) -> str:
+        if "pnpm-lock.yaml" in entries:
             return "pnpm"
-        if (root / "yarn.lock").exists():
+        if "yarn.lock" in entries:
             return "yarn"
-        if (root / "package-lock.json").exists():
-            return "npm"
-        if (root / "package.json").exists():
+        if "package-lock.json" in entries or "package.json" in entries:
             return "npm"
         return ""
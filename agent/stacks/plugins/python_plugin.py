@@ -1,21 +1,28 @@
 from __future__ import annotations
 
-from pathlib import Path
-from typing import Tuple
+import os
+from typing import Optional, Tuple
 
+from agent.stacks.plugins._fs_cache import has_marker, isfile
+from agent.stacks.plugins._walk import has_ext
 from agent.stacks.plugins.base import StackPlugin
-from agent.stacks.spec import CommandSpec
+from agent.stacks.spec import CommandSpec, RepoScan
 
 
 class PythonPlugin(StackPlugin):
     def supports(self, language: str) -> bool:
         return language == "python"
 
-    def detect(self, repo_root: str) -> Tuple[float, str]:
-        root = Path(repo_root)
-        if (root / "pyproject.toml").exists() or (root / "requirements.txt").exists():
+    def detect(self, repo_root: str, scan: Optional[RepoScan] = None) -> Tuple[float, str]:
+        if scan is not None:
+            if scan.has("pyproject.toml") or scan.has("requirements.txt"):
+                return 0.9, "python"
+            if scan.has_ext(".py"):
+                return 0.6, "python"
+            return 0.0, ""
+        if isfile(os.path.join(repo_root, "pyproject.toml")) or isfile(os.path.join(repo_root, "requirements.txt")):
             return 0.9, "python"
-        if list(root.glob("**/*.py")):
+        if has_ext(repo_root, (".py",)):
             return 0.6, "python"
         return 0.0, ""
 
@@ -25,12 +32,12 @@ class PythonPlugin(StackPlugin):
     def default_toolchain_version(self, language: str) -> str:
         return "3.11"
 
-    def default_commands(self, repo_root: str, language: str) -> CommandSpec:
-        root = Path(repo_root)
-        if (root / "pyproject.toml").exists():
-            return CommandSpec(test="python -m pytest -q")
-        if (root / "requirements.txt").exists() or list(root.glob("**/*.py")):
-            return CommandSpec(test="pytest -q")
+    def default_commands(self, repo_root: str, language: str, scan: Optional[RepoScan] = None) -> CommandSpec:
+        if has_marker(repo_root, "pyproject.toml", scan):
+            return CommandSpec(test="python -m pytest -q -n auto --dist=loadfile")
+        has_py = scan.has_ext(".py") if scan is not None else has_ext(repo_root, (".py",))
+        if has_marker(repo_root, "requirements.txt", scan) or has_py:
+            return CommandSpec(test="pytest -q -n auto --dist=loadfile")
         return CommandSpec(test="")
 
     def allowed_test_prefixes(self, language: str) -> list[str]:
@@ -1,50 +1,153 @@
 from __future__ import annotations
 
+from functools import lru_cache
+import importlib
+import os
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Optional, Tuple
 
 import yaml  # PyYAML
 
-from agent.stacks.spec import StackSpec, ToolchainSpec, CommandSpec, DependencySpec
-from agent.stacks.catalog_utils import catalog_stacks_view, auto_detect_stack_id
+from agent.stacks.spec import StackSpec, ToolchainSpec, CommandSpec, DependencySpec, RepoScan
+from agent.stacks.catalog_utils import catalog_stacks_view, auto_detect_stack_id, clear_repo_paths_cache
+from agent.stacks.plugins._fs_cache import clear_fs_cache
+from agent.stacks.plugins._walk import SKIP
 from agent.stacks.plugins.base import StackPlugin
-from agent.stacks.plugins.python_plugin import PythonPlugin
-from agent.stacks.plugins.node_plugin import NodePlugin
-from agent.stacks.plugins.java_plugin import JavaPlugin
-from agent.stacks.plugins.dotnet_plugin import DotnetPlugin
-from agent.stacks.plugins.go_plugin import GoPlugin
-from agent.stacks.plugins.generic_plugin import GenericPlugin
 
 
 CATALOG_PATH = Path("agent/stacks/catalog.yml")
 
-# Built-in plugin registry (language/toolchain aware).
-PLUGINS: List[StackPlugin] = [
-    PythonPlugin(),
-    NodePlugin(),
-    JavaPlugin(),
-    DotnetPlugin(),
-    GoPlugin(),
-    GenericPlugin(),
-]
+# Built-in plugin registry (language/toolchain aware), in detection order.
+# Plugins are imported and instantiated lazily, on first use.
+_PLUGIN_FACTORIES: Dict[str, Tuple[str, str]] = {
+    "python": ("agent.stacks.plugins.python_plugin", "PythonPlugin"),
+    "node": ("agent.stacks.plugins.node_plugin", "NodePlugin"),
+    "java": ("agent.stacks.plugins.java_plugin", "JavaPlugin"),
+    "dotnet": ("agent.stacks.plugins.dotnet_plugin", "DotnetPlugin"),
+    "go": ("agent.stacks.plugins.go_plugin", "GoPlugin"),
+    "generic": ("agent.stacks.plugins.generic_plugin", "GenericPlugin"),
+}
+
+# Declared language -> plugin key.
+_LANGUAGE_PLUGINS: Dict[str, str] = {
+    "python": "python",
+    "javascript": "node",
+    "typescript": "node",
+    "java": "java",
+    "dotnet": "dotnet",
+    "csharp": "dotnet",
+    "go": "go",
+}
+
+# Cheap pre-check on a RepoScan (root entries, extensions) before a plugin is even loaded.
+_PLUGIN_HINTS: Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {
+    "python": (("pyproject.toml", "requirements.txt"), (".py",)),
+    "node": (("package.json",), (".ts", ".js")),
+    "java": (("pom.xml", "gradlew"), (".java",)),
+    "dotnet": ((), (".sln", ".csproj", ".cs")),
+    "go": (("go.mod",), (".go",)),
+}
+
+
+@lru_cache(maxsize=None)
+def _load_plugin(key: str) -> StackPlugin:
+    module_name, class_name = _PLUGIN_FACTORIES[key]
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def _get_plugin_for(language: str) -> StackPlugin:
+    """Plugin for a declared language; GenericPlugin when the language is unknown."""
+    return _load_plugin(_LANGUAGE_PLUGINS.get(language, "generic"))
+
+
+@lru_cache(maxsize=8)
+def _load_catalog_cached(path: str, mtime_ns: int) -> Dict[str, Any]:
+    return yaml.safe_load(Path(path).read_text(encoding="utf-8")) or {}
 
 
 def load_catalog(path: Path = CATALOG_PATH) -> Dict[str, Any]:
-    if not path.exists():
+    """
+    Parse catalog.yml once per (path, mtime). The returned dict is shared between callers:
+    treat it as read-only. CATALOG_RELOAD=1 bypasses every cache and re-parses the YAML.
+    """
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except OSError:
         return {}
-    return yaml.safe_load(path.read_text(encoding="utf-8")) or {}
-
-
-def detect_language(repo_root: str = ".") -> Tuple[str, StackPlugin]:
-    """Best-effort detection based on repo files. Returns (language, plugin)."""
-    best: Tuple[float, str, StackPlugin] = (0.0, "", GenericPlugin())
-    for plugin in PLUGINS:
-        score, lang = plugin.detect(repo_root)
+    if os.environ.get("CATALOG_RELOAD", "").strip() == "1":
+        return yaml.safe_load(path.read_text(encoding="utf-8")) or {}
+    return _load_catalog_cached(str(path), mtime_ns)
+
+
+# Source suffixes the plugins look for; the walk stops once all of them were seen.
+_SCAN_EXTS = frozenset({".py", ".ts", ".js", ".java", ".cs", ".sln", ".csproj", ".go"})
+
+
+def _scan_repo(repo_root: str = ".") -> RepoScan:
+    """Walk the repo once (os.scandir) collecting root entries and the source extensions present."""
+    scan = RepoScan(root=repo_root)
+    pending = [repo_root]
+    while pending:
+        current = pending.pop()
+        try:
+            it = os.scandir(current)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if current == repo_root:
+                    scan.top_level.add(entry.name)
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if is_dir:
+                    if entry.name not in SKIP:
+                        pending.append(entry.path)
+                    continue
+                ext = os.path.splitext(entry.name)[1].lower()
+                if ext in _SCAN_EXTS:
+                    scan.extensions.add(ext)
+        if len(scan.extensions) == len(_SCAN_EXTS):
+            break
+    return scan
+
+
+def _detect_from_scan(repo_root: str, scan: RepoScan) -> Tuple[str, StackPlugin]:
+    best: Tuple[float, str, StackPlugin] = (0.0, "", _load_plugin("generic"))
+    for key, (names, exts) in _PLUGIN_HINTS.items():
+        if not any(scan.has(n) for n in names) and not any(scan.has_ext(e) for e in exts):
+            continue
+        plugin = _load_plugin(key)
+        score, lang = plugin.detect(repo_root, scan)
         if score > best[0]:
             best = (score, lang, plugin)
     return best[1] or "", best[2]
 
 
+@lru_cache(maxsize=32)
+def _cached_scan(abs_root: str) -> RepoScan:
+    return _scan_repo(abs_root)
+
+
+def detect_language(repo_root: str = ".", scan: Optional[RepoScan] = None) -> Tuple[str, StackPlugin]:
+    """
+    Best-effort detection based on repo files. Returns (language, plugin).
+    Without an explicit scan the repo walk is memoized per absolute repo root for the whole
+    process (the layout does not change mid-run); call clear_detection_cache() to reset.
+    """
+    if scan is None:
+        scan = _cached_scan(os.path.abspath(repo_root))
+    return _detect_from_scan(repo_root, scan)
+
+
+def clear_detection_cache() -> None:
+    """Drop every per-process view of the repo layout (scan, marker stats, glob walk) after files are added."""
+    _cached_scan.cache_clear()
+    clear_fs_cache()
+    clear_repo_paths_cache()
+
+
 def resolve_stack_spec(
     run_req: Dict[str, Any],
     repo_root: str = ".",
@@ -67,41 +170,46 @@ def resolve_stack_spec(
     # Start with catalog entry if present.
     c = stacks.get(stack_id, {}) if stack_id and isinstance(stacks, dict) else {}
     c_lang = (c.get("language") or "").strip().lower()
-
-    # Detect if not given.
-    detected_lang, detected_plugin = detect_language(repo_root)
-
-    # Determine final language.
-    language = req_lang or c_lang or detected_lang
-    # Pick plugin by language (fallback to detected plugin / generic).
-    plugin = next((p for p in PLUGINS if p.supports(language)), None) or detected_plugin
+    c_cmds = c.get("commands") or {}
+    c_tool = c.get("toolchain") or {}
+    c_deps = c.get("deps") or {}
+    c_meta = c.get("meta") or {}
+
+    # Determine final language; only walk the repo when neither the request nor the catalog declares it.
+    language = req_lang or c_lang
+    scan: Optional[RepoScan] = None
+    if language:
+        plugin = _get_plugin_for(language)
+    else:
+        # The same scan answers detection, default commands and meta without re-stat'ing markers.
+        scan = _cached_scan(os.path.abspath(repo_root))
+        language, plugin = detect_language(repo_root, scan)
 
     # Toolchain defaults from plugin, overridden by catalog (toolchain.version) if present.
-    toolchain_kind = (c.get("toolchain", {}) or {}).get("kind") or plugin.default_toolchain_kind(language)
-    toolchain_version = (c.get("toolchain", {}) or {}).get("version") or plugin.default_toolchain_version(language)
+    toolchain_kind = c_tool.get("kind") or plugin.default_toolchain_kind(language)
+    toolchain_version = c_tool.get("version") or plugin.default_toolchain_version(language)
 
     # Commands: prefer explicit request > catalog > plugin defaults
-    default_cmds = plugin.default_commands(repo_root, language)
+    default_cmds = plugin.default_commands(repo_root, language, scan)
     commands = CommandSpec(
-        install=(c.get("commands", {}) or {}).get("install") or default_cmds.install,
-        build=(c.get("commands", {}) or {}).get("build") or default_cmds.build,
-        test=req_test or (c.get("test_command") or "") or (c.get("commands", {}) or {}).get("test") or default_cmds.test,
-        lint=(c.get("commands", {}) or {}).get("lint") or default_cmds.lint,
+        install=c_cmds.get("install") or default_cmds.install,
+        build=c_cmds.get("build") or default_cmds.build,
+        test=req_test or (c.get("test_command") or "") or c_cmds.get("test") or default_cmds.test,
+        lint=c_cmds.get("lint") or default_cmds.lint,
     )
 
     # Dependencies from catalog only (plugins shouldn't install big deps implicitly).
-    deps = c.get("deps", {}) or {}
     dep_spec = DependencySpec(
-        apt=list(deps.get("apt") or []),
-        pip=list(deps.get("pip") or []),
-        npm=list(deps.get("npm") or []),
+        apt=list(c_deps.get("apt") or []),
+        pip=list(c_deps.get("pip") or []),
+        npm=list(c_deps.get("npm") or []),
     )
 
     allowed_prefixes = list(c.get("allowed_test_prefixes") or plugin.allowed_test_prefixes(language))
 
     meta = {}
-    meta.update(c.get("meta") or {})
-    meta.update(plugin.compute_meta(repo_root, language))
+    meta.update(c_meta)
+    meta.update(plugin.compute_meta(repo_root, language, scan))
 
     return StackSpec(
         stack_id=stack_id,
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Set
 
 
 @dataclass
@@ -54,6 +54,24 @@ class BootstrapSpec:
     commands: List[str] = field(default_factory=list)
 
 
+@dataclass
+class RepoScan:
+    """
+    One-pass view of a repo used by plugin detection (built by registry._scan_repo).
+    top_level: entry names at the repo root (marker files like pom.xml, go.mod).
+    extensions: lowercase suffixes of source files seen anywhere (".py", ".ts", ...).
+    """
+    root: str = "."
+    top_level: Set[str] = field(default_factory=set)
+    extensions: Set[str] = field(default_factory=set)
+
+    def has(self, name: str) -> bool:
+        return name in self.top_level
+
+    def has_ext(self, ext: str) -> bool:
+        return ext in self.extensions
+
+
 @dataclass
 class StackSpec:
     """Resolved spec used across extract_request, stack_setup and orchestrator.
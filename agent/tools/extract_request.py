@@ -2,42 +2,71 @@ import json
 import os
 import re
 import sys
-from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 from agent.stacks.catalog_utils import (
     bootstrap_kind_for_stack,
-    markers_found_for_stack,
-    repo_has_any_stack_markers,
+    scan_markers,
 )
 from agent.stacks.registry import resolve_stack_spec, load_catalog
 
 
+# Shared with the orchestrator, so the workflow and the agent accept exactly the same comments
+_CMD_PREFIX_RE = re.compile(r"/agent\s+run\s*(?=\{)", re.IGNORECASE)
+_JSON_DECODER = json.JSONDecoder()
+
+
 def extract_json_from_comment(body: str) -> Dict[str, Any]:
     """Expected formats:
       /agent run { ...json... }
       { ...json... }
+    Text after the object is ignored. raw_decode stops where the JSON object ends, so braces
+    inside strings and trailing text never need a regex or a hand-written brace counter.
     """
-    if not body:
+    if not body or not body.strip():
         raise ValueError("COMMENT_BODY vacío")
 
-    m = re.search(r"/agent\s+run\s*(\{.*\})\s*$", body.strip(), re.DOTALL)
-    if not m:
-        m = re.search(r"(\{.*\})", body.strip(), re.DOTALL)
-    if not m:
+    text = body.strip()
+    m = _CMD_PREFIX_RE.search(text)
+    if m:
+        try:
+            obj, _ = _JSON_DECODER.raw_decode(text, m.end())
+        except json.JSONDecodeError as e:
+            raise ValueError(f"JSON inválido en comentario: {e}") from e
+        return obj
+
+    # Sin prefijo: primer objeto JSON decodificable a partir de algún "{"
+    idx = text.find("{")
+    if idx < 0:
         raise ValueError("No se encontró JSON. Usa: /agent run { ... }")
+    first_err: Optional[json.JSONDecodeError] = None
+    while idx >= 0:
+        try:
+            obj, _ = _JSON_DECODER.raw_decode(text, idx)
+            if isinstance(obj, dict):
+                return obj
+        except json.JSONDecodeError as e:
+            first_err = first_err or e
+        idx = text.find("{", idx + 1)
+    raise ValueError(f"JSON inválido en comentario: {first_err}")
 
-    raw = m.group(1)
+
+def write_out(rel_path: str, content: str) -> None:
+    # Open first; create the parent dir only when it is missing
     try:
-        return json.loads(raw)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"JSON inválido en comentario: {e}") from e
+        f = open(rel_path, "w", encoding="utf-8")
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(rel_path), exist_ok=True)
+        f = open(rel_path, "w", encoding="utf-8")
+    with f:
+        f.write(content or "")
 
 
-def write_out(rel_path: str, content: str) -> None:
-    p = Path(rel_path)
-    p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(content or "", encoding="utf-8")
+def _no_markers_note(requested_stack: str, bootstrap_kind: str) -> str:
+    return (
+        f"Repo has no stack markers. Keeping requested stack='{requested_stack}'. "
+        f"bootstrap.kind='{bootstrap_kind}'. stack_setup will scaffold if configured.\n"
+    )
 
 
 def main() -> None:
@@ -53,47 +82,39 @@ def main() -> None:
     spec = resolve_stack_spec(req, repo_root=".", catalog=catalog)
 
     # Enterprise guard: if explicit stack but markers not found, try fallback auto.
-    if explicit_stack and not markers_found_for_stack(catalog, spec.stack_id, repo_root="."):
-        if repo_has_any_stack_markers(catalog, repo_root="."):
+    # One pass over every stack's markers; the guard below only does lookups.
+    stack_markers = scan_markers(catalog, repo_root=".") if explicit_stack else {}
+    resolution = ""
+    no_bootstrap = False
+    if explicit_stack and not stack_markers.get(spec.stack_id, False):
+        if any(stack_markers.values()):
             # Repo seems like SOME known stack => auto-detect
             fallback_req = dict(req)
             fallback_req["stack"] = "auto"
             spec2 = resolve_stack_spec(fallback_req, repo_root=".", catalog=catalog)
 
-            if markers_found_for_stack(catalog, spec2.stack_id, repo_root="."):
-                write_out(
-                    "agent/out/stack_resolution.txt",
-                    (
-                        f"Stack mismatch: requested='{requested_stack}' but markers not found. "
-                        f"Fallback to auto-detected='{spec2.stack_id}'.\n"
-                    ),
+            if stack_markers.get(spec2.stack_id, False):
+                resolution = (
+                    f"Stack mismatch: requested='{requested_stack}' but markers not found. "
+                    f"Fallback to auto-detected='{spec2.stack_id}'.\n"
                 )
                 spec = spec2
             else:
                 # Repo without markers for any stack, allow bootstrap if defined.
                 bk = bootstrap_kind_for_stack(catalog, requested_stack)
-                write_out(
-                    "agent/out/stack_resolution.txt",
-                    (
-                        f"Repo has no stack markers. Keeping requested stack='{requested_stack}'. "
-                        f"bootstrap.kind='{bk}'. stack_setup will scaffold if configured.\n"
-                    ),
-                )
-                if bk in ("none", "", "unknown"):
-                    raise ValueError(
-                        f"Stack mismatch: requested='{requested_stack}' pero el repo no contiene markers "
-                        "y este stack no define bootstrap. Usa stack='auto' o agrega bootstrap en catalog.yml."
-                    )
+                resolution = _no_markers_note(requested_stack, bk)
+                no_bootstrap = bk in ("none", "", "unknown")
         else:
             # Greenfield: keep requested; bootstrap may scaffold.
-            bk = bootstrap_kind_for_stack(catalog, requested_stack)
-            write_out(
-                "agent/out/stack_resolution.txt",
-                (
-                    f"Repo has no stack markers. Keeping requested stack='{requested_stack}'. "
-                    f"bootstrap.kind='{bk}'. stack_setup will scaffold if configured.\n"
-                ),
-            )
+            resolution = _no_markers_note(requested_stack, bootstrap_kind_for_stack(catalog, requested_stack))
+
+    if resolution:
+        write_out("agent/out/stack_resolution.txt", resolution)
+    if no_bootstrap:
+        raise ValueError(
+            f"Stack mismatch: requested='{requested_stack}' pero el repo no contiene markers "
+            "y este stack no define bootstrap. Usa stack='auto' o agrega bootstrap en catalog.yml."
+        )
 
     out_path = os.environ.get("GITHUB_OUTPUT")
     outputs = {
@@ -110,9 +131,9 @@ def main() -> None:
         print(json.dumps(outputs, ensure_ascii=False))
         return
 
+    payload = "".join(f"{k}={v}\n" for k, v in outputs.items())
     with open(out_path, "a", encoding="utf-8") as f:
-        for k, v in outputs.items():
-            f.write(f"{k}={v}\n")
+        f.write(payload)
 
 
 if __name__ == "__main__":
@@ -1,17 +1,24 @@
 # agent/tools/failure_hints.py
 from __future__ import annotations
 
+import hashlib
 import os
 import re
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import List, Dict, Any, Optional, Tuple
 
+try:
+    import re2  # google-re2: linear-time matching for rule patterns
+except Exception:
+    re2 = None
+
 
 @dataclass(frozen=True)
 class FailureMeta:
     kind: str
     hints: List[str]
-    signature: str  # stable-ish signature for stuck detection
+    signature: str  # stable-ish signature for stuck detection (kind:blake2b of normalized output)
     matched_rule_id: Optional[str] = None
 
 
@@ -40,29 +47,63 @@ def _load_yaml(path: str) -> Optional[Dict[str, Any]]:
         return None
 
 
-def _get_rules_config() -> Dict[str, Any]:
+def _rules_candidates(env_path: str) -> List[str]:
+    """FAILURE_HINTS_RULES_PATH (if set) first, then the default locations."""
+    return ([env_path] if env_path else []) + _DEFAULT_RULES_PATHS
+
+
+_RE_LEADING_FLAGS = re.compile(r"^\(\?([aiLmsux]+)\)")
+_RE_BACKREF = re.compile(r"\\[1-9]|\(\?P=")
+
+
+def _union_source(patterns: List["re.Pattern[str]"]) -> Optional[str]:
     """
-    Loads YAML config from FAILURE_HINTS_RULES_PATH or default locations.
-    Returns empty config if unavailable.
+    Alternation source for several patterns, or None when they cannot be safely combined.
+    Leading global flags like "(?i)" become scoped groups "(?i:...)" so they stay per-pattern.
     """
-    env_path = (os.environ.get("FAILURE_HINTS_RULES_PATH") or "").strip()
-    if env_path:
-        cfg = _load_yaml(env_path)
-        if cfg:
-            return cfg
+    parts: List[str] = []
+    for p in patterns:
+        src = p.pattern
+        if _RE_BACKREF.search(src):
+            return None  # group numbers shift inside an alternation
+        m = _RE_LEADING_FLAGS.match(src)
+        if m:
+            src = f"(?{m.group(1)}:{src[m.end():]})"
+        parts.append(f"(?:{src})")
+    return "|".join(parts)
+
+
+def _compile_pattern(source: str) -> "re.Pattern[str]":
+    """
+    re2 when installed and the pattern fits its syntax (no lookaround/backrefs), else stdlib re.
+    Raises re.error when neither can compile it.
+    """
+    if re2 is not None:
+        try:
+            return re2.compile(source)
+        except Exception:
+            pass
+    return re.compile(source)
 
-    for p in _DEFAULT_RULES_PATHS:
-        cfg = _load_yaml(p)
-        if cfg:
-            return cfg
 
-    return {}
+def _compile_union(source: Optional[str]) -> Optional["re.Pattern[str]"]:
+    if source is None:
+        return None
+    try:
+        return _compile_pattern(source)
+    except re.error:
+        return None
+
 
+_Rules = Tuple[List[Dict[str, Any]], Dict[str, List[str]], Optional["re.Pattern[str]"]]
 
-def _compile_rules(cfg: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Dict[str, List[str]]]:
+
+def _compile_rules(cfg: Dict[str, Any]) -> _Rules:
     """
     Compile regex patterns. Invalid patterns are ignored.
-    Returns (rules, language_hints).
+    Returns (rules, language_hints, prefilter). Each rule also carries "union": all its patterns
+    as one regex (None if they cannot be combined), so matching a rule is a single scan.
+    prefilter is the union of every rule pattern: when it finds nothing, no rule can match.
     """
     rules_in = cfg.get("rules") or []
     compiled: List[Dict[str, Any]] = []
@@ -79,7 +120,7 @@ def _compile_rules(cfg: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Dict[str,
                 if not isinstance(p, str) or not p.strip():
                     continue
                 try:
-                    compiled_patterns.append(re.compile(p))
+                    compiled_patterns.append(_compile_pattern(p))
                 except re.error:
                     # ignore invalid regex (hotfix-friendly)
                     continue
@@ -93,11 +134,13 @@ def _compile_rules(cfg: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Dict[str,
                     "priority": int(r.get("priority") or 1000),
                     "stop_on_match": bool(r.get("stop_on_match", True)),
                     "patterns": compiled_patterns,
+                    "union": _compile_union(_union_source(compiled_patterns)),
                     "hints": [str(x) for x in (r.get("hints") or []) if isinstance(x, str) and x.strip()],
                 }
             )
 
     compiled.sort(key=lambda x: x["priority"])
+    prefilter = _compile_union(_union_source([p for r in compiled for p in r["patterns"]]))
 
     lang_hints_in = cfg.get("language_hints") or {}
     lang_hints: Dict[str, List[str]] = {}
@@ -108,47 +151,91 @@ def _compile_rules(cfg: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Dict[str,
             if isinstance(v, list):
                 lang_hints[k.lower().strip()] = [str(x) for x in v if isinstance(x, str) and x.strip()]
 
-    return compiled, lang_hints
+    return compiled, lang_hints, prefilter
+
 
+@lru_cache(maxsize=4)
+def _compiled_rules(path: str, mtime_ns: int) -> Optional[_Rules]:
+    """Compiled rules for one (path, mtime): editing the file invalidates, otherwise no re-parse. None if unusable."""
+    cfg = _load_yaml(path)
+    return _compile_rules(cfg) if cfg else None
 
-# Cache per-process (Actions run)
-_RULES_CACHE: Optional[Tuple[List[Dict[str, Any]], Dict[str, List[str]]]] = None
 
+# FAILURE_HINTS_RULES_PATH value -> rules file that actually loaded (skips re-probing the candidates)
+_RULES_PATH: Dict[str, str] = {}
 
-def _rules() -> Tuple[List[Dict[str, Any]], Dict[str, List[str]]]:
-    global _RULES_CACHE
-    if _RULES_CACHE is None:
-        cfg = _get_rules_config()
-        _RULES_CACHE = _compile_rules(cfg)
-    return _RULES_CACHE
+
+def _rules() -> _Rules:
+    env_path = (os.environ.get("FAILURE_HINTS_RULES_PATH") or "").strip()
+    known = _RULES_PATH.get(env_path)
+    candidates = _rules_candidates(env_path)
+    if known:
+        candidates = [known] + [p for p in candidates if p != known]
+    for p in candidates:
+        try:
+            mtime_ns = os.stat(p).st_mtime_ns
+        except OSError:
+            continue
+        compiled = _compiled_rules(p, mtime_ns)
+        if compiled is not None:
+            _RULES_PATH[env_path] = p
+            return compiled
+    _RULES_PATH.pop(env_path, None)
+    return [], {}, None
 
 
 # ---------------------------
 # Built-in helpers
 # ---------------------------
 
+# Signature noise (paths, :line, "line N", whitespace runs) in one pass; lastgroup picks the replacement
+_RE_SIG_NOISE = re.compile(
+    r"(?P<path>/[A-Za-z0-9_\-./]+|[A-Za-z]:\\\\[A-Za-z0-9_\-\\\\.]+)"
+    r"|(?P<col>:\d+)"
+    r"|(?P<line>(?i:line)\s+\d+)"
+    r"|(?P<ws>\s+)"
+)
+_SIG_NOISE_REPL = {"path": "<PATH>", "col": ":<N>", "line": "line <N>", "ws": " "}
+
+# One alternation: a single scan of the output instead of one per pattern
+_FLOAT_RE = re.compile(
+    "|".join(
+        f"(?:{p})"
+        for p in (
+            r"\d+\.\d+\s*!=\s*\d+\.\d+",
+            r"expected.*\d+\.\d+.*but.*\d+\.\d+",
+            r"Expected:.*\d+\.\d+.*Received:.*\d+\.\d+",
+            r"E\s+assert\s+.*\d+\.\d+.*==\s+.*\d+\.\d+",
+            r"AssertionError:.*\d+\.\d+.*\d+\.\d+",
+        )
+    ),
+    re.IGNORECASE,
+)
+
+
+CLASSIFY_WINDOW_CHARS = 16_000
+SIGNATURE_MAX_CHARS = 2500
+
+
 def _normalize_for_signature(text: str) -> str:
     """
     Reduce ruido (paths/line numbers/timestamps) para detectar repetición real del error.
     """
-    t = text or ""
-    t = re.sub(r"(/[A-Za-z0-9_\-./]+)+", "<PATH>", t)
-    t = re.sub(r"[A-Za-z]:\\\\[A-Za-z0-9_\-\\\\.]+", "<PATH>", t)
-    t = re.sub(r":\d+", ":<N>", t)
-    t = re.sub(r"line\s+\d+", "line <N>", t, flags=re.IGNORECASE)
-    t = re.sub(r"\s+", " ", t).strip()
-    return t[:2500]
+    # Normalize the whole text, then cut: cutting the raw input first would let outputs that only
+    # differ past the cut collide once whitespace/paths shrink the head.
+    t = _RE_SIG_NOISE.sub(lambda m: _SIG_NOISE_REPL[m.lastgroup], text or "").strip()
+    return t[:SIGNATURE_MAX_CHARS]
+
+
+def _signature_digest(normalized: str) -> str:
+    return hashlib.blake2b(normalized.encode("utf-8", errors="ignore"), digest_size=12).hexdigest()
 
 
 def _builtin_float_patterns_match(out: str) -> bool:
-    float_patterns = [
-        r"\d+\.\d+\s*!=\s*\d+\.\d+",
-        r"expected.*\d+\.\d+.*but.*\d+\.\d+",
-        r"Expected:.*\d+\.\d+.*Received:.*\d+\.\d+",
-        r"E\s+assert\s+.*\d+\.\d+.*==\s+.*\d+\.\d+",
-        r"AssertionError:.*\d+\.\d+.*\d+\.\d+",
-    ]
-    return any(re.search(p, out, flags=re.IGNORECASE) for p in float_patterns)
+    # Every float pattern needs a decimal literal: skip the regex scans when there is no "."
+    if "." not in out:
+        return False
+    return _FLOAT_RE.search(out) is not None
 
 
 def _builtin_kind_fallback(test_output: str) -> str:
@@ -185,9 +272,15 @@ def classify_failure(
     Rules are evaluated first (ordered by priority).
     """
     out = test_output or ""
+    # Bound the regex work on very verbose runs: collection/import errors show up at the head,
+    # assertion failures and the summary at the tail.
+    if len(out) > 2 * CLASSIFY_WINDOW_CHARS:
+        out = out[:CLASSIFY_WINDOW_CHARS] + "\n" + out[-CLASSIFY_WINDOW_CHARS:]
     lang = (language or "").lower().strip()
 
-    rules, language_hints = _rules()
+    rules, language_hints, prefilter = _rules()
+    if prefilter is not None and prefilter.search(out) is None:
+        rules = []  # one scan proved that no rule pattern occurs in the output
 
     # 1) Apply external rules (first match wins if stop_on_match)
     best_kind: Optional[str] = None
@@ -195,7 +288,12 @@ def classify_failure(
     best_rule_id: Optional[str] = None
 
     for r in rules:
-        if any(p.search(out) for p in r["patterns"]):
+        union = r.get("union")
+        if union is not None:
+            matched = union.search(out) is not None
+        else:
+            matched = any(p.search(out) for p in r["patterns"])
+        if matched:
             best_kind = r["kind"]
             best_hints.extend(r.get("hints") or [])
             best_rule_id = r.get("id") or None
@@ -218,7 +316,9 @@ def classify_failure(
         if any(k in out.lower() for k in ["credit", "cuota", "interest", "interés", "amort"]):
             hints.append("Dominio financiero: considera Decimal/centavos (integers) para evitar drift de float.")
 
-    signature = f"{kind}:{_normalize_for_signature(out)}"
+    # Fixed-size key: signatures are only compared for equality
+    # Signature from the full output (not the classification window): differences anywhere count
+    signature = f"{kind}:{_signature_digest(_normalize_for_signature(test_output or ''))}"
     return FailureMeta(kind=kind, hints=hints, signature=signature, matched_rule_id=best_rule_id)
 
 
@@ -252,25 +352,13 @@ def should_count_as_stuck(prev_signature: str, new_signature: str, changed_files
     if prev_signature != new_signature:
         return False
 
-    # Normalize changed_files into a sorted list[str]
-    files_list: List[str] = []
+    # Any non-blank changed file means work is happening (not stuck); stop at the first one.
+    # (You can tighten this heuristic later if needed.)
     if changed_files is None:
-        files_list = []
-    elif isinstance(changed_files, list):
-        files_list = [str(f).strip() for f in changed_files if str(f).strip()]
-    else:
-        # assume string-like
-        s = str(changed_files or "")
-        # If it's an empty/whitespace string => no changes
-        if not s.strip():
-            files_list = []
-        else:
-            files_list = [f.strip() for f in s.splitlines() if f.strip()]
-
-    # If no changed files, we're stuck when signature repeats
-    if not files_list:
         return True
-
-    # If there are changed files, we consider it not-stuck (work is happening)
-    # (You can tighten this heuristic later if needed.)
-    return False
+    if isinstance(changed_files, list):
+        lines = (str(f) for f in changed_files)
+    else:
+        # assume string-like (newline-separated)
+        lines = str(changed_files or "").splitlines()
+    return not any(line.strip() for line in lines)
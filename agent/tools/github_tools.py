@@ -1,29 +1,81 @@
 import os
 import json
 import subprocess
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+try:
+    import orjson
+except Exception:
+    orjson = None
 
-def run(cmd: List[str], check: bool = True) -> str:
+# Issue fields the orchestrator reads; projected by gh's jq so the rest is never parsed.
+ISSUE_FIELDS_JQ = "{number, title, body, state, labels: [.labels[]?.name]}"
+
+
+def _loads(raw: str) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _run_rc(cmd: List[str], check: bool = True) -> Tuple[int, str]:
     p = subprocess.run(cmd, text=True, capture_output=True)
     if check and p.returncode != 0:
         raise RuntimeError(
             f"Command failed: {' '.join(cmd)}\nSTDOUT:\n{p.stdout}\nSTDERR:\n{p.stderr}"
         )
-    return (p.stdout or "").strip()
+    return p.returncode, (p.stdout or "").strip()
+
+
+def run(cmd: List[str], check: bool = True) -> str:
+    return _run_rc(cmd, check=check)[1]
+
+
+# Read-only queries whose answer only changes through the mutating helpers below
+# (checkout/commit/push/PR create), which clear the cache. `git status` is deliberately
+# not here: patches edit the worktree without going through this module.
+_READONLY_PREFIXES: Tuple[Tuple[str, ...], ...] = (
+    ("git", "rev-parse"),
+    ("gh", "pr", "view"),
+)
+_READONLY_CACHE: Dict[Tuple[str, ...], str] = {}
+
+
+def run_cached(cmd: List[str], check: bool = True) -> str:
+    """run() memoized for allowlisted read-only commands; only successful results are cached."""
+    key = tuple(cmd)
+    if not any(key[: len(pfx)] == pfx for pfx in _READONLY_PREFIXES):
+        return run(cmd, check=check)
+    if key in _READONLY_CACHE:
+        return _READONLY_CACHE[key]
+    code, out = _run_rc(cmd, check=check)
+    if code == 0:
+        _READONLY_CACHE[key] = out
+    return out
+
+
+def _invalidate_readonly_cache() -> None:
+    _READONLY_CACHE.clear()
 
 
 def gh_api(path: str) -> Dict[str, Any]:
     out = run(["gh", "api", path])
-    return json.loads(out)
+    return _loads(out)
+
+
+def gh_api_project(path: str, jq_expr: str) -> Dict[str, Any]:
+    """gh api with a server-side jq projection (-q): only the selected fields come back."""
+    out = run(["gh", "api", path, "-q", jq_expr])
+    return _loads(out)
 
 
 def get_issue(repo: str, issue_number: str) -> Dict[str, Any]:
-    return gh_api(f"repos/{repo}/issues/{issue_number}")
+    return gh_api_project(f"repos/{repo}/issues/{issue_number}", ISSUE_FIELDS_JQ)
 
 
 def ensure_branch(branch: str, base: str = "main") -> None:
     """Checkout an existing branch if it exists; otherwise create it from base."""
+    _invalidate_readonly_cache()
     # If branch exists locally, checkout
     p = subprocess.run(
         ["git", "show-ref", "--verify", f"refs/heads/{branch}"],
@@ -51,43 +103,100 @@ def ensure_branch(branch: str, base: str = "main") -> None:
 
 def create_branch(branch: str, base: str = "HEAD") -> None:
     """Backwards compatible: create a new branch from base."""
+    _invalidate_readonly_cache()
     run(["git", "checkout", "-b", branch, base])
 
 
 def current_branch() -> str:
-    return run(["git", "rev-parse", "--abbrev-ref", "HEAD"])
+    return run_cached(["git", "rev-parse", "--abbrev-ref", "HEAD"])
 
 
 def git_status_porcelain() -> str:
     return run(["git", "status", "--porcelain"], check=False)
 
 
+def git_status_entries() -> List[str]:
+    """
+    `git status --porcelain -z` entries as "XY path" strings (renames keep the new path).
+    NUL-separated output avoids path quoting; stdout is not stripped (unlike run())
+    because the leading status column is significant.
+    """
+    p = subprocess.run(["git", "status", "--porcelain", "-z"], text=True, capture_output=True)
+    if p.returncode != 0:
+        return []
+    out: List[str] = []
+    entries = (p.stdout or "").split("\0")
+    i = 0
+    while i < len(entries):
+        entry = entries[i]
+        i += 1
+        if len(entry) < 4:
+            continue
+        out.append(entry)
+        # Renames/copies: "R  new\0old\0" -> keep the new path, skip the original one
+        if entry[0] in "RC" or entry[1] in "RC":
+            i += 1
+    return out
+
+
+def git_changes(entries: Optional[List[str]] = None) -> List[str]:
+    """Paths changed in the worktree (modified, staged, deleted, renamed and untracked)."""
+    if entries is None:
+        entries = git_status_entries()
+    return [e[3:] for e in entries]
+
+
+_BOT_NAME = "github-actions[bot]"
+_BOT_EMAIL = "41898282+github-actions[bot]@users.noreply.github.com"
+
+
+def _set_bot_identity() -> None:
+    """
+    Bot identity through GIT_AUTHOR_*/GIT_COMMITTER_* for this process (and its git children):
+    no `git config` forks and nothing written to the repo config. Only used when git
+    reports a missing identity, so a configured one is never overridden.
+    """
+    os.environ.setdefault("GIT_AUTHOR_NAME", _BOT_NAME)
+    os.environ.setdefault("GIT_AUTHOR_EMAIL", _BOT_EMAIL)
+    os.environ.setdefault("GIT_COMMITTER_NAME", _BOT_NAME)
+    os.environ.setdefault("GIT_COMMITTER_EMAIL", _BOT_EMAIL)
+
+
 def git_commit_all(message: str) -> None:
+    _invalidate_readonly_cache()
     run(["git", "add", "-A"])
     try:
         run(["git", "commit", "-m", message])
     except RuntimeError as e:
         msg = str(e)
         if "Author identity unknown" in msg or "empty ident name" in msg:
-            # Configure identity locally (no global)
-            run(["git", "config", "user.name", "github-actions[bot]"])
-            run(
-                ["git", "config", "user.email", "41898282+github-actions[bot]@users.noreply.github.com"]
-            )
+            _set_bot_identity()
             run(["git", "commit", "-m", message])
             return
         # Allow no-op commits to be handled by callers
         raise
 
 
-def git_commits_ahead(base_ref: str, head_ref: str = "HEAD") -> int:
-    """Returns how many commits head_ref is ahead of base_ref."""
-    # Ensure we have base_ref locally.
+_FETCHED = False
+
+
+def _ensure_fetch() -> None:
+    """Refresh origin/* remote-tracking refs at most once per process."""
+    global _FETCHED
+    if _FETCHED:
+        return
     subprocess.run(
         ["git", "fetch", "--no-tags", "--prune", "origin", "+refs/heads/*:refs/remotes/origin/*"],
         text=True,
         capture_output=True,
     )
+    _FETCHED = True
+
+
+def git_commits_ahead(base_ref: str, head_ref: str = "HEAD") -> int:
+    """Returns how many commits head_ref is ahead of base_ref."""
+    # Ensure we have base_ref locally.
+    _ensure_fetch()
     out = run(["git", "rev-list", "--count", f"{base_ref}..{head_ref}"], check=False)
     try:
         return int((out or "0").strip() or 0)
@@ -96,23 +205,21 @@ def git_commits_ahead(base_ref: str, head_ref: str = "HEAD") -> int:
 
 
 def git_push(branch: str) -> None:
+    _invalidate_readonly_cache()
     run(["git", "push", "origin", branch])
 
 
 def gh_pr_view_url(head: str) -> Optional[str]:
     """Return PR URL for the given head branch if one exists, else None."""
-    p = subprocess.run(
-        ["gh", "pr", "view", head, "--json", "url", "-q", ".url"],
-        text=True,
-        capture_output=True,
-    )
-    if p.returncode != 0:
+    try:
+        url = run_cached(["gh", "pr", "view", head, "--json", "url", "-q", ".url"])
+    except RuntimeError:
         return None
-    url = (p.stdout or "").strip()
     return url or None
 
 
 def gh_pr_create(title: str, body: str, head: str, base: str = "main") -> str:
+    _invalidate_readonly_cache()
     out = run(["gh", "pr", "create", "--title", title, "--body", body, "--head", head, "--base", base])
     return out  # contains URL
 
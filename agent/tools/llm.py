@@ -1,43 +1,197 @@
+import atexit
+import hashlib
 import os
 import json
 import re
-from typing import Any, Dict, Optional
-from datetime import datetime
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
 from pathlib import Path
 
-from openai import OpenAI
+import httpx
+from openai import BadRequestError, DefaultHttpxClient, OpenAI
+
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+except Exception:
+    h2 = None
 
 DEFAULT_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
 
+# Keep connections alive across chat_json calls: one TCP+TLS handshake per run, not per request
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=300.0)
+
 _client: Optional[OpenAI] = None
 
 
+def _http_client() -> httpx.Client:
+    # limits/http2 belong to the transport once one is passed; retries only cover connect errors
+    transport = httpx.HTTPTransport(limits=_HTTP_LIMITS, http2=h2 is not None, retries=2)
+    http_client = DefaultHttpxClient(transport=transport)
+    atexit.register(http_client.close)
+    return http_client
+
+
 def client() -> OpenAI:
     global _client
     if _client is None:
-        _client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+        _client = OpenAI(api_key=os.environ["OPENAI_API_KEY"], http_client=_http_client())
     return _client
 
 
-def _out_dir() -> Path:
-    p = Path("agent/out")
-    p.mkdir(parents=True, exist_ok=True)
-    return p
+# Exact-match response cache for low-temperature (near-deterministic) calls. Values are stored as
+# JSON text so every hit hands out a fresh dict. LLM_CACHE_DB=<path> adds a persistent SQLite layer.
+LLM_CACHE_MAX_ENTRIES = 1024
+LLM_CACHE_MAX_TEMPERATURE = 0.2
+LLM_CACHE_TTL_S = 7 * 24 * 3600
+
+_RESPONSE_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_cache_db: Optional[sqlite3.Connection] = None
+_cache_db_path: Optional[str] = None
+# chat_json also runs on the orchestrator's llm_pool threads: the LRU and the shared SQLite
+# connection are only touched under this lock
+_CACHE_LOCK = threading.Lock()
+
+
+def _loads(raw: str) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass  # stdlib also accepts NaN/Infinity and huge ints; re-parse before calling it invalid
+    return json.loads(raw)
+
+
+def _json_text(obj: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def _cache_key(
+    system: str,
+    user: str,
+    schema_name: str,
+    temperature: float,
+    schema: Optional[Dict[str, Any]] = None,
+) -> str:
+    raw = json.dumps(
+        {"m": DEFAULT_MODEL, "s": system, "u": user, "sc": schema_name, "t": temperature, "j": schema},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8", errors="ignore")).hexdigest()
+
+
+def _cache_conn() -> Optional[sqlite3.Connection]:
+    """
+    SQLite connection for LLM_CACHE_DB (None when unset or unusable). Best-effort: errors disable it.
+    Call with _CACHE_LOCK held; the connection is shared across threads under that lock.
+    """
+    global _cache_db, _cache_db_path
+    path = (os.environ.get("LLM_CACHE_DB") or "").strip()
+    if path != _cache_db_path:
+        if _cache_db is not None:
+            _cache_db.close()
+        _cache_db, _cache_db_path = None, path
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                conn = sqlite3.connect(path, check_same_thread=False)
+                conn.execute("CREATE TABLE IF NOT EXISTS cache(key TEXT PRIMARY KEY, value BLOB, created INTEGER)")
+                _cache_db = conn
+                atexit.register(conn.close)
+            except sqlite3.Error:
+                _cache_db = None
+    return _cache_db
+
+
+def _cache_get(key: str) -> Optional[Dict[str, Any]]:
+    with _CACHE_LOCK:
+        text = _cache_get_text(key)
+    return _loads(text) if text is not None else None
+
+
+def _cache_get_text(key: str) -> Optional[str]:
+    # _CACHE_LOCK held
+    text = _RESPONSE_CACHE.get(key)
+    if text is not None:
+        _RESPONSE_CACHE.move_to_end(key)
+        return text
+    conn = _cache_conn()
+    if conn is None:
+        return None
+    try:
+        row = conn.execute(
+            "SELECT value FROM cache WHERE key = ? AND created >= ?",
+            (key, int(time.time()) - LLM_CACHE_TTL_S),
+        ).fetchone()
+    except sqlite3.Error:
+        return None
+    if row is None:
+        return None
+    text = row[0].decode("utf-8") if isinstance(row[0], bytes) else str(row[0])
+    _cache_put_memory(key, text)
+    return text
+
+
+def _cache_put_memory(key: str, text: str) -> None:
+    # _CACHE_LOCK held
+    _RESPONSE_CACHE[key] = text
+    _RESPONSE_CACHE.move_to_end(key)
+    while len(_RESPONSE_CACHE) > LLM_CACHE_MAX_ENTRIES:
+        _RESPONSE_CACHE.popitem(last=False)
+
+
+def _cache_put(key: str, value: Dict[str, Any]) -> None:
+    text = _json_text(value)
+    with _CACHE_LOCK:
+        _cache_put_memory(key, text)
+        conn = _cache_conn()
+        if conn is None:
+            return
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache(key, value, created) VALUES (?, ?, ?)",
+                    (key, text.encode("utf-8"), int(time.time())),
+                )
+        except sqlite3.Error:
+            pass
+
+
+_OUT_DIR = Path("agent/out")
 
 
 def _write_raw(name: str, content: str) -> str:
-    ts = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
-    path = _out_dir() / f"{name}_{ts}.txt"
-    path.write_text(content or "", encoding="utf-8", errors="replace")
+    ts = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+    path = _OUT_DIR / f"{name}_{ts}.txt"
+    # Write first, mkdir only if agent/out is missing (it can be removed by a `git clean` revert)
+    try:
+        path.write_text(content or "", encoding="utf-8", errors="replace")
+    except FileNotFoundError:
+        _OUT_DIR.mkdir(parents=True, exist_ok=True)
+        path.write_text(content or "", encoding="utf-8", errors="replace")
     return str(path)
 
 
+_RE_FENCE_OPEN = re.compile(r"^```[a-zA-Z0-9_-]*\s*")
+_RE_FENCE_CLOSE = re.compile(r"\s*```$")
+
+
 def _strip_fences(s: str) -> str:
     s = (s or "").strip()
     # Remove triple backticks blocks if present
     if s.startswith("```"):
-        s = re.sub(r"^```[a-zA-Z0-9_-]*\s*", "", s)
-        s = re.sub(r"\s*```$", "", s)
+        s = _RE_FENCE_OPEN.sub("", s)
+        s = _RE_FENCE_CLOSE.sub("", s)
     return s.strip()
 
 
@@ -77,13 +231,14 @@ def _repair_json_with_model(
         "Do NOT include trailing commas. Ensure all strings are closed.\n"
     )
 
-    user = json.dumps(
-        {
-            "schema_name": schema_name,
-            "broken_output": raw_text[:200000],  # hard cap to avoid huge re-prompt
-        },
-        ensure_ascii=False,
-    )
+    payload = {
+        "schema_name": schema_name,
+        "broken_output": raw_text[:200000],  # hard cap to avoid huge re-prompt
+    }
+    if orjson is not None:
+        user = orjson.dumps(payload).decode("utf-8")
+    else:
+        user = json.dumps(payload, ensure_ascii=False)
 
     resp = client().chat.completions.create(
         model=DEFAULT_MODEL,
@@ -98,17 +253,39 @@ def _repair_json_with_model(
     content = resp.choices[0].message.content or ""
     # parse repaired
     extracted = _extract_json_object(content)
-    return json.loads(extracted)
+    return _loads(extracted)
 
 
-def chat_json(system: str, user: str, schema_name: str, temperature: float = 0.2) -> Dict[str, Any]:
+def chat_json(
+    system: str,
+    user: str,
+    schema_name: str,
+    temperature: float = 0.2,
+    schema: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
     """
     Enterprise-hardened JSON chat:
+    - Optional JSON schema sent as response_format json_schema (strict when the schema allows it)
+    - Exact-match cache for temperature <= LLM_CACHE_MAX_TEMPERATURE (memory LRU, optional SQLite)
     - Saves raw model output to agent/out on failure
     - Best-effort JSON extraction (strip fences, take {...})
-    - One repair attempt via model if parsing fails
+    - One repair attempt via model if parsing fails (skipped for strict schemas: the API already
+      guarantees valid JSON, so a failure there is a refusal/truncation a repair cannot fix)
     """
-    messages = [
+    if temperature > LLM_CACHE_MAX_TEMPERATURE:
+        return _chat_json_uncached(system, user, schema_name, temperature, schema)
+    key = _cache_key(system, user, schema_name, temperature, schema)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    result = _chat_json_uncached(system, user, schema_name, temperature, schema)
+    _cache_put(key, result)
+    return result
+
+
+def _messages(system: str, user: str, schema_name: str) -> List[Dict[str, str]]:
+    return [
         {
             "role": "system",
             "content": system
@@ -119,19 +296,74 @@ def chat_json(system: str, user: str, schema_name: str, temperature: float = 0.2
         {"role": "user", "content": user},
     ]
 
-    resp = client().chat.completions.create(
-        model=DEFAULT_MODEL,
-        messages=messages,
-        temperature=temperature,
-        response_format={"type": "json_object"},
-    )
-    content = resp.choices[0].message.content or ""
 
+_JSON_OBJECT_FORMAT: Dict[str, Any] = {"type": "json_object"}
+_RE_API_SCHEMA_NAME = re.compile(r"[^A-Za-z0-9_-]")
+
+# schema_name values whose json_schema response_format the API rejected: later calls go straight to
+# json_object instead of paying a failed round trip each time
+_SCHEMA_REJECTED: set = set()
+
+
+def _strict_compatible(node: Any) -> bool:
+    """
+    Strict structured outputs need every object closed (additionalProperties: false) with all of
+    its properties required. Anything else is sent non-strict.
+    """
+    if isinstance(node, list):
+        return all(_strict_compatible(x) for x in node)
+    if not isinstance(node, dict):
+        return True
+    props = node.get("properties")
+    if isinstance(props, dict):
+        if node.get("additionalProperties") is not False:
+            return False
+        if set(node.get("required") or []) != set(props):
+            return False
+    elif node.get("type") == "object" and node.get("additionalProperties") not in (False, None):
+        return False  # free-form maps cannot be strict
+    return all(_strict_compatible(v) for k, v in node.items() if k not in ("required", "enum", "const"))
+
+
+def _response_format(schema_name: str, schema: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], bool]:
+    """(response_format, strict) for one call."""
+    if not schema or schema_name in _SCHEMA_REJECTED:
+        return _JSON_OBJECT_FORMAT, False
+    strict = _strict_compatible(schema)
+    api_schema = {k: v for k, v in schema.items() if k != "$schema"}
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": _RE_API_SCHEMA_NAME.sub("_", schema_name)[:64] or "response",
+            "schema": api_schema,
+            "strict": strict,
+        },
+    }, strict
+
+
+def _schema_rejected(fmt: Dict[str, Any], err: Exception) -> bool:
+    """A 400 caused by our json_schema response_format (not e.g. context length)."""
+    msg = str(err).lower()
+    return fmt is not _JSON_OBJECT_FORMAT and ("schema" in msg or "response_format" in msg)
+
+
+def _parse_or_repair(content: str, schema_name: str, repair: bool = True) -> Dict[str, Any]:
+    # json_object replies are normally a bare object: parse as-is before any fence/extraction work
+    if content[:1] == "{" and content[-1:] == "}":
+        try:
+            return _loads(content)
+        except ValueError:
+            pass
     try:
         extracted = _extract_json_object(content)
-        return json.loads(extracted)
+        return _loads(extracted)
     except Exception as e:
         raw_path = _write_raw(f"llm_raw_{schema_name}", content)
+        if not repair:
+            raise ValueError(
+                f"LLM output no fue JSON válido para {schema_name} (schema estricto). "
+                f"Se guardó raw en {raw_path}."
+            ) from e
         # One repair attempt
         try:
             repaired = _repair_json_with_model(
@@ -148,3 +380,25 @@ def chat_json(system: str, user: str, schema_name: str, temperature: float = 0.2
                 f"Se guardó raw en {raw_path}. "
                 f"Repair falló: {type(e2).__name__}: {e2}"
             ) from e2
+
+
+def _chat_json_uncached(
+    system: str,
+    user: str,
+    schema_name: str,
+    temperature: float,
+    schema: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    fmt, strict = _response_format(schema_name, schema)
+    kwargs = dict(model=DEFAULT_MODEL, messages=_messages(system, user, schema_name), temperature=temperature)
+    try:
+        resp = client().chat.completions.create(response_format=fmt, **kwargs)
+    except BadRequestError as e:
+        if not _schema_rejected(fmt, e):
+            raise
+        # Schema not accepted (unsupported keyword, etc.): remember and use plain JSON mode
+        _SCHEMA_REJECTED.add(schema_name)
+        fmt, strict = _JSON_OBJECT_FORMAT, False
+        resp = client().chat.completions.create(response_format=fmt, **kwargs)
+    content = resp.choices[0].message.content or ""
+    return _parse_or_repair(content, schema_name, repair=not strict)
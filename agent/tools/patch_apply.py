@@ -1,9 +1,15 @@
 import os
 import re
-import tempfile
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Any, Dict, List, Optional, Tuple
 
+try:
+    import pygit2  # libgit2: apply diffs in-process instead of spawning `git apply`
+except Exception:
+    pygit2 = None
+
 
 # -----------------------------
 # Path hardening (enterprise)
@@ -20,8 +26,10 @@ def _normalize_rel_path(path: str) -> str:
     return p
 
 
+@lru_cache(maxsize=1024)
 def _is_safe_rel_path(path: str) -> Tuple[bool, str]:
     """
+    Pure string check, memoized: paths repeat across iterations/retries.
     Only allow writing within repo workspace:
       - must be relative
       - no absolute paths
@@ -38,18 +46,51 @@ def _is_safe_rel_path(path: str) -> Tuple[bool, str]:
     return True, p
 
 
+# files{} patches with at least this many entries are written from a thread pool
+PARALLEL_WRITE_MIN_FILES = 8
+PARALLEL_WRITE_MAX_WORKERS = 32
+# files{} entries up to this size are compared with the file on disk and skipped when identical
+SKIP_IDENTICAL_MAX_BYTES = 1 << 20
+
+
 def ensure_parent_dir(path: str) -> None:
     parent = os.path.dirname(path)
     if parent:
         os.makedirs(parent, exist_ok=True)
 
 
-def write_file(path: str, content: str) -> None:
-    ensure_parent_dir(path)
+def _write_text(path: str, content: str) -> None:
+    """write_file without the parent-dir step (caller already created it)."""
     with open(path, "w", encoding="utf-8", errors="replace") as f:
         f.write(content if content.endswith("\n") else content + "\n")
 
 
+def _same_on_disk(path: str, text: str) -> bool:
+    """True if path already holds exactly what _write_text would write for text."""
+    if os.linesep != "\n":
+        text = text.replace("\n", os.linesep)  # text-mode newline translation
+    data = text.encode("utf-8", errors="replace")
+    if len(data) > SKIP_IDENTICAL_MAX_BYTES:
+        return False
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(data) + 1) == data
+    except OSError:
+        return False
+
+
+def _write_text_if_changed(path: str, content: str) -> None:
+    # Identical content: no truncate/rewrite, so mtimes and downstream build caches stay valid
+    text = content if content.endswith("\n") else content + "\n"
+    if not _same_on_disk(path, text):
+        _write_text(path, text)
+
+
+def write_file(path: str, content: str) -> None:
+    ensure_parent_dir(path)
+    _write_text(path, content)
+
+
 def delete_file(path: str) -> None:
     try:
         os.remove(path)
@@ -57,32 +98,76 @@ def delete_file(path: str) -> None:
         pass
 
 
+# A "--- old" header directly followed by "+++ new" (a removed "-- x" line alone does not count)
+_RE_FILE_HEADER_PAIR = re.compile(r"^--- [^\n]*\n\+\+\+ ", re.MULTILINE)
+# Numbered hunk header; git apply rejects bare "@@" lines anyway
+_RE_HUNK = re.compile(r"^@@ -\d+(?:,\d+)? \+\d+(?:,\d+)? @@", re.MULTILINE)
+
+
 def looks_like_valid_unified_diff(diff_text: str) -> bool:
-    return ("--- " in diff_text) and ("+++ " in diff_text) and ("@@ " in diff_text)
+    """Structural pre-check, so hopeless diffs skip the git apply attempt entirely."""
+    if ("--- " not in diff_text) or ("+++ " not in diff_text) or ("@@ " not in diff_text):
+        return False
+    return _RE_FILE_HEADER_PAIR.search(diff_text) is not None and _RE_HUNK.search(diff_text) is not None
+
+
+@lru_cache(maxsize=4)
+def _repo(cwd: str):
+    """pygit2 repository containing cwd (None when pygit2 is missing or cwd is not a repo)."""
+    if pygit2 is None:
+        return None
+    try:
+        path = pygit2.discover_repository(cwd)
+        return pygit2.Repository(path) if path else None
+    except Exception:
+        return None
+
+
+def _try_pygit2_apply(diff_text: str) -> bool:
+    """Apply the diff to the working tree with libgit2. False (nothing written) if it cannot."""
+    repo = _repo(os.getcwd())
+    if repo is None:
+        return False
+    try:
+        diff = pygit2.Diff.parse_diff(diff_text)
+        location = pygit2.GIT_APPLY_LOCATION_WORKDIR
+        if not repo.applies(diff, location):
+            return False
+        repo.apply(diff, location)
+        return True
+    except Exception:
+        return False
 
 
 def try_git_apply(diff_text: str) -> None:
     """Apply unified diff using git apply (preferred)."""
-    with tempfile.NamedTemporaryFile("w", delete=False, encoding="utf-8") as f:
-        f.write(diff_text)
-        tmp_path = f.name
-    try:
-        p = subprocess.run(["git", "apply", "--whitespace=nowarn", tmp_path], text=True, capture_output=True)
-        if p.returncode != 0:
-            raise RuntimeError(f"git apply failed:\nSTDOUT:\n{p.stdout}\nSTDERR:\n{p.stderr}")
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
+    # In-process first; anything libgit2 rejects still gets `git apply`'s more lenient parser
+    if _try_pygit2_apply(diff_text):
+        return
+    # Stream the diff on stdin ("-"): no temp file to write, fsync and remove per patch
+    p = subprocess.run(
+        ["git", "apply", "--whitespace=nowarn", "-"],
+        input=diff_text,
+        text=True,
+        encoding="utf-8",
+        capture_output=True,
+    )
+    if p.returncode != 0:
+        raise RuntimeError(f"git apply failed:\nSTDOUT:\n{p.stdout}\nSTDERR:\n{p.stderr}")
+
+
+_RE_PLUSPLUS_B = re.compile(r"\+\+\+\s+b/(.+)")
+_RE_DIFF_GIT = re.compile(r"diff --git a/(.+?) b/(.+)")
+# Added line content ("+x" -> "x"), one C-level scan; "\r?" keeps CRLF diffs working
+_RE_ADDED = re.compile(r"^\+(?!\+\+)([^\r\n]*)\r?$", re.MULTILINE)
 
 
 def extract_target_path_from_headers(diff_text: str) -> Optional[str]:
     """Try to infer file path from '+++ b/<path>' or diff --git headers."""
-    m = re.search(r"\+\+\+\s+b/(.+)", diff_text)
+    m = _RE_PLUSPLUS_B.search(diff_text)
     if m:
         return m.group(1).strip()
-    m = re.search(r"diff --git a/(.+?) b/(.+)", diff_text)
+    m = _RE_DIFF_GIT.search(diff_text)
     if m:
         return m.group(2).strip()
     return None
@@ -94,14 +179,8 @@ def strip_added_lines_to_content(diff_text: str) -> str:
     We only reconstruct file content from '+' lines (excluding headers).
     This is safe for *new file* patches, but NOT for arbitrary edits.
     """
-    lines: List[str] = []
-    for line in diff_text.splitlines():
-        if line.startswith(("--- ", "+++ ", "diff --git", "index ", "new file mode")):
-            continue
-        if line.startswith("@@"):
-            continue
-        if line.startswith("+") and not line.startswith("+++"):
-            lines.append(line[1:])
+    # Only "+" lines survive, so headers/hunk markers need no explicit skip; "+++" is excluded
+    lines = _RE_ADDED.findall(diff_text)
     return ("\n".join(lines).rstrip() + "\n") if lines else ""
 
 
@@ -163,6 +242,9 @@ def apply_patch_object(patch_obj: Dict[str, Any]) -> None:
     # -----------------------
     files_obj = patch_obj.get("files")
     if isinstance(files_obj, dict) and files_obj:
+        # parent dir -> [(path, op, content)] in patch order: one makedirs per directory and
+        # sibling files written back-to-back
+        by_parent: Dict[str, List[Tuple[str, str, str]]] = {}
         for raw_path, raw_val in files_obj.items():
             if not isinstance(raw_path, str) or not raw_path.strip():
                 continue
@@ -183,14 +265,31 @@ def apply_patch_object(patch_obj: Dict[str, Any]) -> None:
             if isinstance(content, str) and content.strip().lower() in ("(archivo vacío)", "(archivo vacio)"):
                 content = ""
 
-            # UPSERT: modify on missing -> add
-            if op == "modify" and not os.path.exists(p):
-                op = "add"
-
-            if op == "delete":
-                delete_file(p)
-            else:
-                write_file(p, content)
+            # UPSERT: modify on a missing file behaves as add; both open with "w" (create or
+            # truncate), so no existence check is needed
+
+            by_parent.setdefault(os.path.dirname(p), []).append((p, op, content))
+
+        def _apply_dir(parent: str, entries: List[Tuple[str, str, str]]) -> None:
+            if parent and any(op != "delete" for _p, op, _c in entries):
+                os.makedirs(parent, exist_ok=True)
+            for p, op, content in entries:
+                if op == "delete":
+                    delete_file(p)
+                else:
+                    _write_text_if_changed(p, content)
+
+        # Every path is validated above, so nothing is written if one is unsafe. Writes release
+        # the GIL: large patches overlap them, one task per directory (a path's entries stay in
+        # order; the pool size bounds open file descriptors).
+        total = sum(len(entries) for entries in by_parent.values())
+        if total >= PARALLEL_WRITE_MIN_FILES and len(by_parent) > 1:
+            workers = min(PARALLEL_WRITE_MAX_WORKERS, len(by_parent))
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                list(ex.map(lambda kv: _apply_dir(*kv), by_parent.items()))
+        else:
+            for parent, entries in by_parent.items():
+                _apply_dir(parent, entries)
 
         # deletions (optional legacy)
         deletions = patch_obj.get("delete")
@@ -209,6 +308,24 @@ def apply_patch_object(patch_obj: Dict[str, Any]) -> None:
     if not isinstance(patches, list):
         raise ValueError("patches debe ser una lista.")
 
+    # Several applicable-looking diffs: one `git apply` for all of them (it is atomic, so a failure
+    # changes nothing). Only the remaining items then go through the per-diff loop; if the batch
+    # fails, every item does, which pinpoints the offending patch and keeps the new-file fallback.
+    batch: List[str] = []
+    rest: List[Any] = []
+    for item in patches:
+        d = str(item.get("diff", "") or "") if isinstance(item, dict) else ""
+        if d and looks_like_valid_unified_diff(d):
+            batch.append(d if d.endswith("\n") else d + "\n")
+        else:
+            rest.append(item)
+    if len(batch) > 1:
+        try:
+            try_git_apply("".join(batch))
+            patches = rest
+        except Exception:
+            pass
+
     for item in patches:
         if not isinstance(item, dict):
             continue
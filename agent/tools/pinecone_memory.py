@@ -1,15 +1,14 @@
+import hashlib
 import os
 import time
 from typing import Any, Dict, List
 from pinecone import Pinecone
 
-from openai import OpenAI
+from agent.tools.llm import client as _openai
 
 EMBED_MODEL = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small").strip()
 
-
-def _openai() -> OpenAI:
-    return OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+_index = None
 
 
 def embed(texts: List[str]) -> List[List[float]]:
@@ -20,9 +19,12 @@ def embed(texts: List[str]) -> List[List[float]]:
 
 
 def index():
-    pc = Pinecone(api_key=os.environ["PINECONE_API_KEY"])
-    host = os.environ["PINECONE_INDEX_HOST"]
-    return pc.Index(host=host)
+    """One Pinecone client/index per process, so its connection pool is reused across calls."""
+    global _index
+    if _index is None:
+        pc = Pinecone(api_key=os.environ["PINECONE_API_KEY"])
+        _index = pc.Index(host=os.environ["PINECONE_INDEX_HOST"])
+    return _index
 
 
 def namespace(repo: str, issue_number: str) -> str:
@@ -31,28 +33,67 @@ def namespace(repo: str, issue_number: str) -> str:
     return f"{prefix}{base}" if prefix else base
 
 
+# (namespace, vector id) known to be stored: upserted or fetched by this process
+_UPSERTED: set[tuple[str, str]] = set()
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8", errors="ignore"), digest_size=16).hexdigest()
+
+
+def _stored_ids(idx, ids: List[str], ns: str) -> set[str]:
+    """Subset of ids already present in the namespace (one fetch); empty if the fetch fails."""
+    try:
+        res = idx.fetch(ids=ids, namespace=ns)
+    except Exception:
+        return set()
+    vectors = res.get("vectors") if isinstance(res, dict) else getattr(res, "vectors", None)
+    return set(vectors or {}) & set(ids)
+
+
 def upsert_texts(repo: str, issue_number: str, items: List[Dict[str, Any]]) -> None:
     """
     items: [{ "id": "...", "text": "...", "metadata": {...}}]
+
+    The vector id is the BLAKE2b hash of the text (the caller's id is kept as metadata
+    "event_id"), so a text stored by any earlier run is found with one fetch by id and is
+    not embedded again; repeats within the batch are dropped too.
     """
-    idx = index()
     ns = namespace(repo, issue_number)
 
-    texts = [str(it.get("text", "")) for it in items]
+    fresh: Dict[str, Dict[str, Any]] = {}
+    for it in items:
+        vid = _content_hash(str(it.get("text", "")))
+        if (ns, vid) in _UPSERTED or vid in fresh:
+            continue
+        fresh[vid] = it
+    if not fresh:
+        return
+
+    idx = index()
+    for vid in _stored_ids(idx, list(fresh), ns):
+        fresh.pop(vid)
+        _UPSERTED.add((ns, vid))
+    if not fresh:
+        return
+
+    texts = [str(it.get("text", "")) for it in fresh.values()]
     vecs = embed(texts)
 
     vectors = []
-    for it, v in zip(items, vecs):
+    for (vid, it), v in zip(fresh.items(), vecs):
         md = dict(it.get("metadata", {}) or {})
         md["ts"] = int(time.time())
+        md.setdefault("event_id", str(it.get("id")))
 
         # Store a truncated text copy for easier retrieval/compact context
         if "text" not in md:
             md["text"] = str(it.get("text", ""))[:2000]
 
-        vectors.append((str(it.get("id")), v, md))
+        vectors.append((vid, v, md))
 
     idx.upsert(vectors=vectors, namespace=ns)
+    _UPSERTED.update((ns, vid) for vid in fresh)
 
 
 def query(repo: str, issue_number: str, text: str, top_k: int = 8) -> List[Dict[str, Any]]:
@@ -1,5 +1,5 @@
 import os
-from typing import Dict, List, Optional, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 MAX_FILE_BYTES = 60_000
 
@@ -22,20 +22,26 @@ def _should_skip_dir(dirpath: str) -> bool:
     return any(p in DEFAULT_IGNORE_DIRS for p in parts if p)
 
 
-def list_files(root: str = ".") -> List[str]:
-    out: List[str] = []
+def iter_files(root: str = ".") -> Iterator[str]:
+    """
+    Lazily yield repo files (ignored dirs pruned, binary suffixes skipped), walking
+    directories and files in name order so early-exit callers stay deterministic.
+    """
     for dirpath, dirnames, filenames in os.walk(root):
         if _should_skip_dir(dirpath):
             dirnames[:] = []
             continue
-        dirnames[:] = [d for d in dirnames if d not in DEFAULT_IGNORE_DIRS]
+        dirnames[:] = sorted(d for d in dirnames if d not in DEFAULT_IGNORE_DIRS)
 
-        for fn in filenames:
+        for fn in sorted(filenames):
             lower = fn.lower()
             if any(lower.endswith(s) for s in DEFAULT_IGNORE_SUFFIXES):
                 continue
-            path = os.path.join(dirpath, fn).replace("\\", "/")
-            out.append(path)
+            yield os.path.join(dirpath, fn).replace("\\", "/")
+
+
+def list_files(root: str = ".") -> List[str]:
+    out = list(iter_files(root))
     out.sort()
     return out
 
@@ -51,12 +57,33 @@ def read_file_safe(path: str) -> str:
         return f"<<error reading file: {e}>>"
 
 
+# path -> (mtime_ns, size, content): snapshot() re-reads a file only when its stat changes
+_SNAPSHOT_CACHE: Dict[str, Tuple[int, int, str]] = {}
+
+
+def _read_file_cached(path: str) -> str:
+    try:
+        st = os.stat(path)
+    except OSError:
+        _SNAPSHOT_CACHE.pop(path, None)
+        return read_file_safe(path)
+    hit = _SNAPSHOT_CACHE.get(path)
+    if hit is not None and hit[0] == st.st_mtime_ns and hit[1] == st.st_size:
+        return hit[2]
+    content = read_file_safe(path)
+    _SNAPSHOT_CACHE[path] = (st.st_mtime_ns, st.st_size, content)
+    return content
+
+
 def snapshot(files_or_max: Union[List[str], int, None] = None) -> Dict[str, str]:
     """Return a snapshot of repository text files (path -> content).
 
     - If a list[str] is provided, snapshot only those paths (best for prompt focus).
     - If an int is provided, snapshot first N files from list_files().
     - If None, defaults to 120 files.
+
+    File contents are cached per (mtime, size), so repeated snapshots only re-read
+    files that changed on disk.
     """
     if isinstance(files_or_max, list):
         files = files_or_max
@@ -66,5 +93,5 @@ def snapshot(files_or_max: Union[List[str], int, None] = None) -> Dict[str, str]
 
     out: Dict[str, str] = {}
     for p in files:
-        out[p] = read_file_safe(p)
+        out[p] = _read_file_cached(p)
     return out
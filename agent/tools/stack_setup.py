@@ -5,7 +5,7 @@ import sys
 from pathlib import Path
 from typing import Any, Dict, List
 
-from agent.stacks.registry import load_catalog, resolve_stack_spec
+from agent.stacks.registry import clear_detection_cache, load_catalog, resolve_stack_spec
 
 
 def run(cmd: List[str], check: bool = True) -> subprocess.CompletedProcess:
@@ -141,6 +141,10 @@ def preflight_bootstrap(spec, catalog_entry: Dict[str, Any]) -> Dict[str, Any]:
     else:
         report["notes"].append("bootstrap.kind is none/unknown; cannot scaffold automatically.")
 
+    # Bootstrap wrote files: drop the memoized repo layout before anything re-reads it
+    if report["bootstrap_applied"]:
+        clear_detection_cache()
+
     # Re-check markers after bootstrap
     report["markers_found_after"] = bool(exists_any(any_of))
     if not report["markers_found_after"]:
@@ -232,6 +236,9 @@ def install_safety_nets(spec) -> None:
 
     if spec.language == "python" and ("pytest" in tc):
         run([sys.executable, "-m", "pip", "install", "pytest"], check=False)
+        # -n (pytest-xdist) falla con "unrecognized arguments" si el plugin no está instalado
+        if " -n " in f" {tc} ":
+            run([sys.executable, "-m", "pip", "install", "pytest-xdist"], check=False)
 
     if spec.language in ("javascript", "typescript") and ("jest" in tc):
         pm = str(spec.meta.get("package_manager") or "npm")
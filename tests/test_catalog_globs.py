@@ -0,0 +1,93 @@
+import glob
+import os
+
+import pytest
+
+from agent.stacks import catalog_utils
+from agent.stacks.catalog_utils import _combined_glob_regex, _iter_glob, exists_any_glob
+
+TREE = [
+    "pom.xml",
+    "a.py",
+    "b.txt",
+    "ab.txt",
+    "a.cfg",
+    "c.cfg",
+    ".env",
+    ".hidden/pom.xml",
+    "src/main/java/App.java",
+    "src/main/resources/app.yml",
+    "src/.cache/x.java",
+    "web/package.json",
+    "web/src/index.ts",
+    "svc/api/Api.csproj",
+    "svc/api/.hidden.csproj",
+    "manage.py",
+    "config/settings.py",
+]
+
+PATTERNS = [
+    "pom.xml",
+    "**/pom.xml",
+    "*.py",
+    "*/settings.py",
+    "?.txt",
+    "??.txt",
+    "[ab].cfg",
+    "[!a].cfg",
+    "[a-c].cfg",
+    ".env",
+    "*",
+    "**/.hidden",
+    "src/**",
+    "src/**/*.java",
+    "**/*.csproj",
+    "**/package.json",
+    "**/*.ts",
+    "./manage.py",
+]
+
+
+@pytest.fixture
+def repo(tmp_path):
+    for rel in TREE:
+        p = tmp_path / rel
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text("x", encoding="utf-8")
+    catalog_utils.clear_repo_paths_cache()
+    yield str(tmp_path)
+    catalog_utils.clear_repo_paths_cache()
+
+
+def _rel(root, paths):
+    return {os.path.relpath(p, root).replace(os.sep, "/") for p in paths}
+
+
+@pytest.mark.parametrize("pattern", PATTERNS)
+def test_translated_glob_matches_stdlib_glob(repo, pattern):
+    expected = _rel(repo, glob.glob(os.path.join(repo, pattern.removeprefix("./")), recursive=True))
+    assert _rel(repo, _iter_glob(pattern, repo_root=repo)) == expected
+
+
+def test_combined_regex_matches_the_union_of_its_patterns(repo):
+    pats = ("**/pom.xml", "[!a].cfg", "src/**/*.java", "?.txt")
+    rx = _combined_glob_regex(pats)
+    union = set()
+    for p in pats:
+        union |= _rel(repo, glob.glob(os.path.join(repo, p), recursive=True))
+    walked = set(catalog_utils._repo_paths(os.path.abspath(repo)))
+    assert {rel for rel in walked if rx.match(rel)} == union
+
+
+def test_exists_any_glob(repo):
+    assert exists_any_glob(["**/*.csproj"], repo_root=repo)
+    assert exists_any_glob(["nope.txt", "**/package.json"], repo_root=repo)
+    assert not exists_any_glob(["**/*.go", "go.mod"], repo_root=repo)
+    assert not exists_any_glob([], repo_root=repo)
+
+
+def test_skip_dirs_are_pruned(repo):
+    os.makedirs(os.path.join(repo, "node_modules", "pkg"))
+    open(os.path.join(repo, "node_modules", "pkg", "package.json"), "w").close()
+    catalog_utils.clear_repo_paths_cache()
+    assert _rel(repo, _iter_glob("**/package.json", repo_root=repo)) == {"web/package.json"}
@@ -0,0 +1,48 @@
+import pytest
+
+from agent import orchestrator
+from agent.tools.extract_request import extract_json_from_comment
+
+
+def test_orchestrator_and_workflow_share_the_parser():
+    assert orchestrator.extract_json_from_comment is extract_json_from_comment
+
+
+@pytest.mark.parametrize("prefix", ["/agent run", "/Agent Run", "/AGENT   RUN", "/agent\nrun"])
+def test_command_prefix_is_case_insensitive(prefix):
+    assert extract_json_from_comment(f'{prefix} {{"stack": "python"}}') == {"stack": "python"}
+
+
+def test_braces_inside_strings_do_not_end_the_object():
+    body = '/agent run {"user_story": "crear {x} y cerrar }", "nested": {"a": {"b": "}{"}}}'
+    assert extract_json_from_comment(body) == {
+        "user_story": "crear {x} y cerrar }",
+        "nested": {"a": {"b": "}{"}},
+    }
+
+
+def test_escaped_quotes_inside_strings():
+    body = r'/agent run {"msg": "dice \"hola}\" y sigue", "n": 1}'
+    assert extract_json_from_comment(body) == {"msg": 'dice "hola}" y sigue', "n": 1}
+
+
+def test_trailing_text_after_the_object_is_ignored():
+    body = '/agent run {"stack": "node"}\n\nGracias! {no es json}'
+    assert extract_json_from_comment(body) == {"stack": "node"}
+
+
+def test_bare_json_skips_leading_non_json_braces():
+    body = 'Por favor {ver nota} ejecuta:\n{"stack": "go", "constraints": ["a{b"]} fin'
+    assert extract_json_from_comment(body) == {"stack": "go", "constraints": ["a{b"]}
+
+
+@pytest.mark.parametrize("body", ["", "   ", "sin json aquí"])
+def test_missing_json_is_rejected(body):
+    with pytest.raises(ValueError):
+        extract_json_from_comment(body)
+
+
+@pytest.mark.parametrize("body", ['/agent run {"a": }', '{"a": 1'])
+def test_invalid_json_reports_a_value_error(body):
+    with pytest.raises(ValueError, match="JSON inválido"):
+        extract_json_from_comment(body)
@@ -0,0 +1,15 @@
+from agent.tools.failure_hints import classify_failure
+
+
+def test_difference_after_collapsed_whitespace_changes_the_signature():
+    pad = " " * 40_000
+    a = classify_failure(f"AssertionError:{pad}expected 1")
+    b = classify_failure(f"AssertionError:{pad}expected 2")
+    assert a.signature != b.signature
+
+
+def test_paths_and_line_numbers_do_not_change_the_signature():
+    a = classify_failure("AssertionError: 1 != 2 at /home/a/x.py:12")
+    b = classify_failure("AssertionError: 1 != 2 at /tmp/b/x.py:87")
+    assert a.signature == b.signature
+
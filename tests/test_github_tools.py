@@ -0,0 +1,47 @@
+import subprocess
+
+import pytest
+
+from agent.tools import github_tools
+
+
+@pytest.fixture
+def fake_proc(monkeypatch):
+    """subprocess.run replacement: pops (returncode, stdout) results in order and records calls."""
+    results = []
+    calls = []
+
+    def _fake(cmd, **kwargs):
+        calls.append(cmd)
+        code, out = results.pop(0)
+        return subprocess.CompletedProcess(cmd, code, stdout=out, stderr="boom" if code else "")
+
+    monkeypatch.setattr(github_tools.subprocess, "run", _fake)
+    github_tools._invalidate_readonly_cache()
+    yield results, calls
+    github_tools._invalidate_readonly_cache()
+
+
+CMD = ["gh", "pr", "view", "agent/issue-1", "--json", "url", "-q", ".url"]
+
+
+def test_check_false_returns_output_instead_of_raising(fake_proc):
+    results, calls = fake_proc
+    results.append((1, ""))
+    assert github_tools.run_cached(CMD, check=False) == ""
+
+
+def test_check_true_still_raises_for_cached_commands(fake_proc):
+    results, _ = fake_proc
+    results.append((1, ""))
+    with pytest.raises(RuntimeError):
+        github_tools.run_cached(CMD)
+
+
+def test_only_successful_results_are_cached(fake_proc):
+    results, calls = fake_proc
+    results.extend([(1, ""), (0, "https://example/pr/1")])
+    assert github_tools.run_cached(CMD, check=False) == ""
+    assert github_tools.run_cached(CMD, check=False) == "https://example/pr/1"
+    assert github_tools.run_cached(CMD, check=False) == "https://example/pr/1"
+    assert len(calls) == 2
@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+from agent.tools import llm
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    """Replace the model call with a counter; every real call returns a new payload."""
+    calls = []
+
+    def _fake(system, user, schema_name, temperature, schema=None):
+        calls.append((system, user, schema_name, temperature, schema))
+        return {"n": len(calls)}
+
+    monkeypatch.delenv("LLM_CACHE_DB", raising=False)
+    monkeypatch.setattr(llm, "_chat_json_uncached", _fake)
+    llm._RESPONSE_CACHE.clear()
+    yield calls
+    llm._RESPONSE_CACHE.clear()
+
+
+def test_identical_call_is_served_from_cache(fake_model):
+    first = llm.chat_json("sys", "user", "plan.schema.json")
+    second = llm.chat_json("sys", "user", "plan.schema.json")
+    assert first == second == {"n": 1}
+    assert len(fake_model) == 1
+
+
+def test_cache_hit_returns_a_fresh_dict(fake_model):
+    llm.chat_json("sys", "user", "plan.schema.json")["n"] = 99
+    assert llm.chat_json("sys", "user", "plan.schema.json") == {"n": 1}
+
+
+def test_different_schema_or_temperature_misses(fake_model):
+    llm.chat_json("sys", "user", "plan.schema.json")
+    llm.chat_json("sys", "user", "patch.schema.json")
+    llm.chat_json("sys", "user", "plan.schema.json", temperature=0.0)
+    llm.chat_json("sys", "user", "plan.schema.json", schema={"type": "object"})
+    assert len(fake_model) == 4
+
+
+def test_high_temperature_is_never_cached(fake_model):
+    llm.chat_json("sys", "user", "plan.schema.json", temperature=0.7)
+    llm.chat_json("sys", "user", "plan.schema.json", temperature=0.7)
+    assert len(fake_model) == 2
+
+
+def test_sqlite_layer_is_usable_from_worker_threads(fake_model, monkeypatch, tmp_path):
+    monkeypatch.setenv("LLM_CACHE_DB", str(tmp_path / "llm_cache.sqlite"))
+    llm.chat_json("sys", "user", "plan.schema.json")  # opens the connection on this thread
+    llm._RESPONSE_CACHE.clear()  # force the next lookups down to SQLite
+
+    results = []
+    workers = [
+        threading.Thread(target=lambda: results.append(llm.chat_json("sys", "user", "plan.schema.json")))
+        for _ in range(4)
+    ]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+    assert results == [{"n": 1}] * 4
+    assert len(fake_model) == 1
@@ -0,0 +1,12 @@
+from agent import orchestrator
+
+
+def test_load_json_returns_an_independent_dict_per_call(tmp_path):
+    path = tmp_path / "schema.json"
+    path.write_text('{"required": ["a"], "properties": {"a": {"type": "string"}}}', encoding="utf-8")
+
+    first = orchestrator.load_json(str(path))
+    first["required"].append("b")
+    first["properties"].clear()
+
+    assert orchestrator.load_json(str(path)) == {"required": ["a"], "properties": {"a": {"type": "string"}}}
@@ -0,0 +1,44 @@
+import subprocess
+
+import pytest
+
+from agent.tools import patch_apply
+
+DIFF = """\
+--- a/app.py
++++ b/app.py
+@@ -1,2 +1,2 @@
+ def f():
+-    return 1
++    return 2
+"""
+
+STALE_DIFF = DIFF.replace("-    return 1", "-    return 7")
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    subprocess.run(["git", "init", "-q", str(tmp_path)], check=True)
+    (tmp_path / "app.py").write_text("def f():\n    return 1\n", encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_pygit2_applies_a_unified_diff(repo):
+    pytest.importorskip("pygit2")
+    assert patch_apply._try_pygit2_apply(DIFF) is True
+    assert (repo / "app.py").read_text(encoding="utf-8") == "def f():\n    return 2\n"
+
+
+def test_pygit2_rejects_a_diff_that_does_not_apply(repo):
+    pytest.importorskip("pygit2")
+    assert patch_apply._try_pygit2_apply(STALE_DIFF) is False
+    assert (repo / "app.py").read_text(encoding="utf-8") == "def f():\n    return 1\n"
+
+
+def test_git_apply_fallback_without_pygit2(repo, monkeypatch):
+    monkeypatch.setattr(patch_apply, "pygit2", None)
+    patch_apply.try_git_apply(DIFF)
+    assert (repo / "app.py").read_text(encoding="utf-8") == "def f():\n    return 2\n"
+    with pytest.raises(RuntimeError, match="git apply failed"):
+        patch_apply.try_git_apply(STALE_DIFF)
@@ -0,0 +1,74 @@
+import pytest
+
+from agent.tools import pinecone_memory
+
+
+class FakeIndex:
+    """In-memory stand-in for a Pinecone index: fetch by id and upsert, per namespace."""
+
+    def __init__(self):
+        self.stored = {}
+        self.fetches = 0
+
+    def fetch(self, ids, namespace=""):
+        self.fetches += 1
+        ns = self.stored.get(namespace, {})
+        return {"vectors": {i: ns[i] for i in ids if i in ns}}
+
+    def upsert(self, vectors, namespace=""):
+        for vid, values, md in vectors:
+            self.stored.setdefault(namespace, {})[vid] = md
+
+
+@pytest.fixture
+def fake_pinecone(monkeypatch):
+    idx = FakeIndex()
+    embedded = []
+
+    def _embed(texts):
+        embedded.extend(texts)
+        return [[0.0] for _ in texts]
+
+    monkeypatch.setattr(pinecone_memory, "index", lambda: idx)
+    monkeypatch.setattr(pinecone_memory, "embed", _embed)
+    pinecone_memory._UPSERTED.clear()
+    yield idx, embedded
+    pinecone_memory._UPSERTED.clear()
+
+
+def _item(event_id, text):
+    return {"id": event_id, "text": text, "metadata": {"kind": "iteration"}}
+
+
+def test_texts_stored_by_an_earlier_run_are_not_embedded_again(fake_pinecone):
+    idx, embedded = fake_pinecone
+    pinecone_memory.upsert_texts("o/r", "7", [_item("iteration:7:run1:1", "exit=1 boom")])
+
+    pinecone_memory._UPSERTED.clear()  # a new process: only the index remembers
+    pinecone_memory.upsert_texts("o/r", "7", [
+        _item("iteration:7:run2:1", "exit=1 boom"),
+        _item("iteration:7:run2:2", "exit=0 ok"),
+    ])
+
+    assert embedded == ["exit=1 boom", "exit=0 ok"]
+    stored = idx.stored[pinecone_memory.namespace("o/r", "7")]
+    assert {md["event_id"] for md in stored.values()} == {"iteration:7:run1:1", "iteration:7:run2:2"}
+
+
+def test_duplicates_in_one_batch_are_embedded_once(fake_pinecone):
+    idx, embedded = fake_pinecone
+    pinecone_memory.upsert_texts("o/r", "7", [_item("a", "same"), _item("b", "same")])
+    pinecone_memory.upsert_texts("o/r", "7", [_item("c", "same")])
+    assert embedded == ["same"]
+    assert idx.fetches == 1  # the second call is answered by the in-process set
+
+
+def test_a_failed_fetch_still_upserts(fake_pinecone, monkeypatch):
+    idx, embedded = fake_pinecone
+
+    def _boom(ids, namespace=""):
+        raise RuntimeError("fetch unavailable")
+
+    monkeypatch.setattr(idx, "fetch", _boom)
+    pinecone_memory.upsert_texts("o/r", "7", [_item("a", "text")])
+    assert embedded == ["text"]
@@ -0,0 +1,20 @@
+from agent.stacks import registry
+from agent.stacks.catalog_utils import exists_any_glob
+from agent.stacks.plugins import _fs_cache
+
+
+def test_clear_detection_cache_sees_new_markers(tmp_path):
+    root = str(tmp_path)
+    registry.clear_detection_cache()
+    assert not exists_any_glob(["go.mod"], repo_root=root)
+    assert not _fs_cache.has_marker(root, "go.mod")
+    assert registry.detect_language(root)[0] != "go"
+
+    (tmp_path / "go.mod").write_text("module x\n", encoding="utf-8")
+    (tmp_path / "main.go").write_text("package main\n", encoding="utf-8")
+    registry.clear_detection_cache()
+
+    assert exists_any_glob(["go.mod"], repo_root=root)
+    assert _fs_cache.has_marker(root, "go.mod")
+    assert registry.detect_language(root)[0] == "go"
+    registry.clear_detection_cache()
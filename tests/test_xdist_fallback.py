@@ -0,0 +1,24 @@
+import pytest
+
+from agent import orchestrator
+
+
+@pytest.mark.parametrize(
+    "cmd, expected",
+    [
+        ("pytest -q -n auto --dist=loadfile", "pytest -q"),
+        ("python -m pytest -ra -n 4 --dist loadscope tests/", "python -m pytest -ra tests/"),
+        ("pytest -q -n2 --numprocesses=3", "pytest -q"),
+        ("pytest -q", "pytest -q"),
+        ("npm test -- -n x", "npm test -- -n x"),
+    ],
+)
+def test_xdist_flags_are_dropped_without_the_plugin(monkeypatch, cmd, expected):
+    monkeypatch.setattr(orchestrator, "find_spec", lambda name: None)
+    assert orchestrator.drop_xdist_flags_if_missing(cmd) == expected
+
+
+def test_xdist_flags_are_kept_when_the_plugin_is_installed(monkeypatch):
+    monkeypatch.setattr(orchestrator, "find_spec", lambda name: object())
+    cmd = "pytest -q -n auto --dist=loadfile"
+    assert orchestrator.drop_xdist_flags_if_missing(cmd) == cmd